@@ -7,7 +7,12 @@ from ta.trend import MACD, EMAIndicator
 from ta.volatility import BollingerBands, AverageTrueRange
 from ta.volume import VolumeWeightedAveragePrice, OnBalanceVolumeIndicator
 
-def calculate_indicators(df):
+def calculate_indicators(df, obv_offset=0.0):
+    """
+    Adds the model's indicators and drops the warm-up rows. OBV is cumulative
+    from the first row of `df`; `obv_offset` shifts it when `df` is only the
+    tail of the data (see tail_inference).
+    """
     df = df.copy()
     close = df['close']
     high = df['high']
@@ -41,7 +46,7 @@ def calculate_indicators(df):
     df['EMA_ratio_short'] =   df['ema_6'] /   df['ema_12']
     
     # 2. On-Balance Volume (OBV)
-    df['OBV'] = OnBalanceVolumeIndicator(close=close, volume=volume).on_balance_volume()
+    df['OBV'] = OnBalanceVolumeIndicator(close=close, volume=volume).on_balance_volume() + obv_offset
     
     # 3. 20-period Volatility (Standard deviation of returns)
     df['volatility_20'] = close.pct_change().rolling(20).std()
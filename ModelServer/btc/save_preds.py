@@ -6,10 +6,14 @@ import os
 MONGO_URI = os.environ.get('CONNECTION_STRING', 'mongodb://localhost:27017/')
 MONGO_DATABASE_NAME = os.environ.get('DATABASE_NAME', 'crypto_predictions')
 
-def save_predictions(y_preds, ticker):
-
-    df = pd.read_csv(f"{training_files_btc}/timestamps_{ticker}.csv", header=None, skiprows=1)
-    timestamps = df.iloc[:, 2].values
+def save_predictions(y_preds, ticker, timestamps=None):
+    """
+    Inserts one document per timestamp with the prediction of every threshold.
+    Without `timestamps`, they are read from the CSV written by create_input.
+    """
+    if timestamps is None:
+        df = pd.read_csv(f"{training_files_btc}/timestamps_{ticker}.csv", header=None, skiprows=1)
+        timestamps = df.iloc[:, 2].values
 
     thresholds = len(y_preds)
     num_preds = len(y_preds[0])
@@ -25,6 +29,8 @@ def save_predictions(y_preds, ticker):
     client = MongoClient(MONGO_URI)
     db = client[MONGO_DATABASE_NAME]
     collection = db[f"binary_{ticker}"]
+    # No-op once it exists; covers collections created after mongo-init ran
+    collection.create_index("timestamp")
 
     documents = []
     for i in range(len(timestamps)):
@@ -1,25 +1,28 @@
 import numpy as np
 import joblib
-from btc.training_data import create_input
+from btc.training_data import create_input, sequence_length, load_model_artifacts
 from btc.create_indicators import calculate_indicators
 from btc.save_preds import save_predictions
 import pandas as pd
 import sys
 from consts import training_files_btc
+from btc.get_current_data import CANDLE_CONSUMER
+from candle_store import read_window, window_front
+from tail_inference import (
+    TAIL_WARMUP_ROWS, raw_obv, tail_state_path,
+    load_tail_state, save_tail_state, build_tail_state, obv_offset
+)
 
-def test_main(ticker, num_preds) :
-    num_preds = int(num_preds)
-
-    thresholds = [0.46, 0.47, 0.48, 0.49, 0.5, 0.51, 0.52, 0.53, 0.54]
+thresholds = [0.46, 0.47, 0.48, 0.49, 0.5, 0.51, 0.52, 0.53, 0.54]
 
-    df = pd.read_csv(f'{training_files_btc}/{ticker}_24k.csv')
-    df = df.dropna()
-    df_with_indicators = calculate_indicators(df)
+def predict_and_save(df_with_indicators, ticker, num_preds):
+    # Resident across update cycles; the classifier, scaler and PCA are always from the same training run
+    artifacts = load_model_artifacts(ticker)
 
-    create_input(df_with_indicators, ticker , num_preds, False)
+    # Sequences and timestamps stay in memory; the training files are left untouched
+    X_test, timestamps = create_input(df_with_indicators, ticker , num_preds, False, save_files=False, artifacts=artifacts)
 
-    model = joblib.load(f'{training_files_btc}/model_{ticker}.pkl')
-    X_test = np.load(f"{training_files_btc}/X_train_{ticker}.npy")
+    model = artifacts['model']
     X_test = X_test.reshape(X_test.shape[0], -1)
 
     y_pred = []
@@ -27,11 +30,37 @@ def test_main(ticker, num_preds) :
     for threshold in thresholds:
         y_pred.append((y_proba[:, 1] > threshold).astype(int))
 
-    save_predictions(y_pred, ticker)
+    save_predictions(y_pred, ticker, timestamps['timestamp'].to_numpy())
     #print(f"updated mongo with {len(y_pred[0])} predictions")
 
+def test_main(ticker, num_preds) :
+    num_preds = int(num_preds)
 
+    df = read_window(ticker, CANDLE_CONSUMER)
+    df = df.dropna()
+    df_with_indicators = calculate_indicators(df)
 
+    predict_and_save(df_with_indicators, ticker, num_preds)
 
+    # Full run: resync the state tail_test_main continues from
+    save_tail_state(tail_state_path(training_files_btc, ticker), build_tail_state(df, raw_obv(df['close'], df['volume']), df['volume']))
+
+def tail_test_main(ticker, num_preds):
+    """
+    Same predictions as test_main, computed from the tail of the window only: the
+    indicators need TAIL_WARMUP_ROWS rows before the newest sequences, and the
+    OBV offset comes from the state of the last full run. Falls back to
+    test_main when the state cannot be continued.
+    """
+    num_preds = int(num_preds)
+    state_path = tail_state_path(training_files_btc, ticker)
 
+    tail = read_window(ticker, CANDLE_CONSUMER, tail_rows=TAIL_WARMUP_ROWS + sequence_length + num_preds).dropna()
+    front_timestamp = window_front(ticker, CANDLE_CONSUMER)
+    resync = obv_offset(load_tail_state(state_path), tail, raw_obv(tail['close'], tail['volume']), front_timestamp)
+    if resync is None:
+        return test_main(ticker, num_preds)
 
+    offset, state = resync
+    predict_and_save(calculate_indicators(tail, obv_offset=offset), ticker, num_preds)
+    save_tail_state(state_path, state)
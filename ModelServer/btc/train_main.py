@@ -3,14 +3,20 @@ from btc.training_data import create_input
 from btc.training import train
 import pandas as pd
 import sys
+from btc.get_current_data import CANDLE_CONSUMER
+from candle_store import read_window
+from model_registry import stage_artifacts, publish_artifacts
 from consts import training_files_btc
 
 def train_main(ticker) :
-    df = pd.read_csv(f'{training_files_btc}/{ticker}_24k.csv')
+    df = read_window(ticker, CANDLE_CONSUMER)
     df = df.dropna()
 
     df_with_indicators = calculate_indicators(df)
     df_with_indicators = define_target(df_with_indicators)
 
-    create_input(df_with_indicators, ticker ,len(df_with_indicators) - 70)
-    train(ticker)
\ No newline at end of file
+    # Workers switch to the new scaler, PCA and classifier together, once all three are written
+    version, artifact_dir = stage_artifacts(training_files_btc, ticker)
+    create_input(df_with_indicators, ticker ,len(df_with_indicators) - 70, artifact_dir=artifact_dir)
+    train(ticker, artifact_dir)
+    publish_artifacts(training_files_btc, ticker, version)
\ No newline at end of file
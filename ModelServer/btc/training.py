@@ -3,7 +3,7 @@ import numpy as np
 from sklearn.utils.class_weight import compute_sample_weight
 from consts import training_files_btc
 
-def train(ticker):
+def train(ticker, artifact_dir=training_files_btc):
     X_train = np.load(f'{training_files_btc}/X_train_{ticker}.npy')
     y_train = np.load(f'{training_files_btc}/y_train_{ticker}.npy')
 
@@ -29,5 +29,5 @@ def train(ticker):
     )
 
     import joblib
-    joblib.dump(model, f'{training_files_btc}/model_{ticker}.pkl')
+    joblib.dump(model, f'{artifact_dir}/model_{ticker}.pkl')
 
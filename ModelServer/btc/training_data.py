@@ -3,7 +3,9 @@ import pandas as pd
 from sklearn.preprocessing import RobustScaler
 from sklearn.decomposition import PCA
 import joblib
+from sequences import sequence_starts, sliding_sequences, window_ends
 from consts import training_files_btc
+from model_registry import load_artifacts
 
 features = [
     'taker_buy_ratio', 'volume_zscore_12', 'ret_1',
@@ -15,68 +17,76 @@ features = [
 
 sequence_length = 70
 
-def create_sequences(data, seq_length, num_sequences, has_target=True):
-    X, y = [], []
-
-    for i in range(len(data)- num_sequences - seq_length + 1, len(data) - seq_length + 1):
-        sequence_data = data[i: i + seq_length].copy()
-        sequence_data["Sequence"] = i
-        X.append(sequence_data)
-
-        if has_target:
-            target_value = data.iloc[i + seq_length - 1]["Target"]
-            target = pd.DataFrame({"Sequence": [i], "Target": [target_value]})
-            y.append(target)
-        else:
-            target_date = data.iloc[i + seq_length -1]["timestamp"]
-            target_date_dataframe = pd.DataFrame({"Sequence": [i],  "timestamp": [target_date]})
-            y.append(target_date_dataframe)
-
+def create_sequences(data, feature_values, seq_length, num_sequences, has_target=True):
+    """
+    Builds the last `num_sequences` windows of `seq_length` rows as a strided
+    (num_sequences, seq_length, F) view over `feature_values`, whose rows are
+    aligned with `data`. Also returns, per window, the Target of its last
+    row, or a Sequence/timestamp frame when there is no target.
+    """
+    X = sliding_sequences(feature_values, seq_length, num_sequences)
 
-    X = pd.concat(X, axis=0)
-    y = pd.concat(y, ignore_index=True)
+    if has_target:
+        y = window_ends(data["Target"].to_numpy(), seq_length, num_sequences)
+    else:
+        y = pd.DataFrame({
+            "Sequence": sequence_starts(len(data), seq_length, num_sequences),
+            "timestamp": window_ends(data["timestamp"], seq_length, num_sequences).reset_index(drop=True)
+        })
 
     return X, y
 
 
+def load_model_artifacts(ticker):
+    """The classifier, scaler and PCA of the published training run, resident in this worker."""
+    return load_artifacts(training_files_btc, ticker, {
+        'model': (f'model_{ticker}.pkl', joblib.load),
+        'scaler': (f'scaler_{ticker}.pkl', joblib.load),
+        'pca': (f'pca_{ticker}.pkl', joblib.load)
+    })
 
-         
-def create_input(data, ticker, num_sequences, has_target=True):
+def create_input(data, ticker, num_sequences, has_target=True, save_files=True, artifact_dir=training_files_btc, artifacts=None):
+    """
+    Scales and projects the features and builds the sequences. Returns
+    (X, y): the (N, sequence_length, 3) windows and either the targets or,
+    without targets, the Sequence/timestamp frame of each window. With
+    `save_files` the arrays are also written to training_files for training.
+
+    With targets the fitted scaler and PCA go to `artifact_dir`, the staged
+    directory of the training run. Without, they come from `artifacts`
+    (see load_model_artifacts), so they match the model that gets the windows.
+    """
     if has_target:
         scaler = RobustScaler()
         scaled = scaler.fit_transform(data[features])
-        joblib.dump(scaler, f'{training_files_btc}/scaler_{ticker}.pkl')
+        joblib.dump(scaler, f'{artifact_dir}/scaler_{ticker}.pkl')
 
         pca = PCA(n_components=3)
         pca_data = pca.fit_transform(scaled)
-        joblib.dump(pca, f'{training_files_btc}/pca_{ticker}.pkl')
+        joblib.dump(pca, f'{artifact_dir}/pca_{ticker}.pkl')
     else:
-        scaler = joblib.load(f'{training_files_btc}/scaler_{ticker}.pkl')
-        pca = joblib.load(f'{training_files_btc}/pca_{ticker}.pkl')
+        artifacts = artifacts or load_model_artifacts(ticker)
+        scaler, pca = artifacts['scaler'], artifacts['pca']
         scaled = scaler.transform(data[features])
         pca_data = pca.transform(scaled)
 
 
-    pca_df = pd.DataFrame(pca_data, columns=[f'PC{i+1}' for i in range(pca_data.shape[1])], index=data.index)
-    data = pd.concat([data, pca_df], axis=1)
-
-    X_data, y_data = create_sequences(data, sequence_length, num_sequences, has_target)
-
-    combined_data = X_data[[f'PC{i+1}' for i in range(pca_data.shape[1])]]
-
-    if has_target:
-        combined_target_data = y_data['Target']
-        y_array = np.array(combined_target_data.values.reshape(-1))
-        np.save(f'{training_files_btc}/y_train_{ticker}.npy', y_array)
-    else:
-        y_data.to_csv(f"{training_files_btc}/timestamps_{ticker}.csv")
+    # The PCA components are the model's features; the windows are views over them
+    X_array, y_data = create_sequences(data, pca_data, sequence_length, num_sequences, has_target)
 
+    if save_files:
+        if has_target:
+            np.save(f'{training_files_btc}/y_train_{ticker}.npy', y_data)
+        else:
+            y_data.to_csv(f"{training_files_btc}/timestamps_{ticker}.csv")
 
-    X_array = np.array(combined_data.values.reshape(-1, sequence_length, 3))
-    np.save(f'{training_files_btc}/X_train_{ticker}.npy', X_array)
+        # np.save writes the strided windows in C order, so the file matches a contiguous copy
+        np.save(f'{training_files_btc}/X_train_{ticker}.npy', X_array)
 
     """
     if has_target:
-        print(f"Final y shape: {y_array.shape}")
-        print(f"Total 0s: {np.sum(y_array == 0)}, Total 1s: {np.sum(y_array == 1)}")
-    """
\ No newline at end of file
+        print(f"Final y shape: {y_data.shape}")
+        print(f"Total 0s: {np.sum(y_data == 0)}, Total 1s: {np.sum(y_data == 1)}")
+    """
+
+    return X_array, y_data
@@ -5,7 +5,7 @@ import time
 from datetime import datetime, timedelta, timezone
 # This function must return (count, latest_timestamp)
 from btc.get_current_data import update_csv_with_latest_hour as update_csv_with_latest_interval
-from btc.test_main import test_main
+from btc.test_main import tail_test_main
 from btc.train_main import train_main
 
 TRAINING_INTERVAL_IN_POINTS = 36  # 3 hours of 5-min data
@@ -39,7 +39,7 @@ def update_btc(symbol, redis_client):
                 latest_processed_timestamp = new_timestamp
 
             # print(f"Fetched {num_new} new 5-min interval(s) for {symbol}. Making predictions...")
-            test_main(symbol, num_new)
+            tail_test_main(symbol, num_new)
             total_new_intervals_this_run += num_new
 
             # 1. Atomically increment the persistent counter for processed data points
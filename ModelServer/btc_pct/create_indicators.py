@@ -5,7 +5,12 @@ from ta.trend import MACD, EMAIndicator
 from ta.volatility import BollingerBands, AverageTrueRange
 from ta.volume import VolumeWeightedAveragePrice, OnBalanceVolumeIndicator
 
-def calculate_indicators(df):
+def calculate_indicators(df, obv_offset=0.0):
+    """
+    Adds the model's indicators and drops the warm-up rows. OBV is cumulative
+    from the first row of `df`; `obv_offset` shifts it when `df` is only the
+    tail of the data (see tail_inference).
+    """
     df = df.copy()
     close = df['close']
     high = df['high']
@@ -29,7 +34,7 @@ def calculate_indicators(df):
     df['MACD_diff'] = macd.macd_diff().abs()
     
     # === Volume Features ===
-    df['OBV'] = OnBalanceVolumeIndicator(close=close, volume=volume).on_balance_volume().abs()
+    df['OBV'] = (OnBalanceVolumeIndicator(close=close, volume=volume).on_balance_volume() + obv_offset).abs()
     inf_cols = df.columns[df.isin([np.inf, -np.inf]).any()]
     
     df = df.dropna()
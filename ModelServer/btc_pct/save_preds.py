@@ -6,14 +6,20 @@ import os
 MONGO_URI = os.environ.get('CONNECTION_STRING', 'mongodb://localhost:27017/')
 MONGO_DATABASE_NAME = os.environ.get('DATABASE_NAME', 'crypto_predictions')
 
-def save_predictions(y_preds, ticker):
-
-    df = pd.read_csv(f"{training_files_btc_pct}/timestamps_{ticker}.csv", header=None, skiprows=1)
-    timestamps = df.iloc[:, 2].values
+def save_predictions(y_preds, ticker, timestamps=None):
+    """
+    Inserts one document per (timestamp, prediction). Without `timestamps`,
+    they are read from the CSV written by create_input.
+    """
+    if timestamps is None:
+        df = pd.read_csv(f"{training_files_btc_pct}/timestamps_{ticker}.csv", header=None, skiprows=1)
+        timestamps = df.iloc[:, 2].values
     
     client = MongoClient(MONGO_URI)
     db = client[MONGO_DATABASE_NAME]
     collection = db[f"pct_{ticker}"]
+    # No-op once it exists; covers collections created after mongo-init ran
+    collection.create_index("timestamp")
 
     docs = [
     {"timestamp": ts, "prediction": pred}
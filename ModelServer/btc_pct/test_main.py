@@ -1,32 +1,70 @@
 import os
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
 import numpy as np
-from btc_pct.training_data import create_input
+from btc_pct.training_data import create_input, sequence_length, load_model_artifacts
 from btc_pct.create_indicators import calculate_indicators
 from btc_pct.save_preds import save_predictions
-from tensorflow.keras.models import load_model # type: ignore
 import pandas as pd
 import sys
 import os
 from consts import training_files_btc_pct
+from btc_pct.get_current_data import CANDLE_CONSUMER
+from candle_store import read_window, window_front
+from tail_inference import (
+    TAIL_WARMUP_ROWS, raw_obv, tail_state_path,
+    load_tail_state, save_tail_state, build_tail_state, obv_offset
+)
+
+scale = 5000
+
+def predict_and_save(df_with_indicators, ticker, num_preds):
+    # Resident across update cycles; the LSTM and scaler are always from the same training run
+    artifacts = load_model_artifacts(ticker)
+
+    # Sequences and timestamps stay in memory; the training files are left untouched
+    X_test, timestamps = create_input(df_with_indicators, ticker , num_preds, False, save_files=False, artifacts=artifacts)
+
+    model = artifacts['model']
+
+
+    y_pred = (np.expm1(model.predict(np.ascontiguousarray(X_test), verbose=0)/ scale)).reshape(-1)
+    y_pred= [float(val) for val in y_pred]
+
+    save_predictions(y_pred, ticker, timestamps['timestamp'].to_numpy())
+
+def obv_volume(df):
+    """The volume calculate_indicators feeds to OBV."""
+    return df['volume'].clip(lower=1e-6, upper=1e6)
 
 def test_main(ticker, num_preds) :
     #ticker = sys.argv[1]
     #num_preds = int(sys.argv[2])
     num_preds = int(num_preds)
 
-    scale = 5000
-
-    df = pd.read_csv(f'{training_files_btc_pct}/{ticker}_24k.csv')
+    df = read_window(ticker, CANDLE_CONSUMER)
     df_with_indicators = calculate_indicators(df)
 
-    create_input(df_with_indicators, ticker , num_preds, False)
+    predict_and_save(df_with_indicators, ticker, num_preds)
 
-    model = load_model(f"{training_files_btc_pct}/model_{ticker}.keras", compile=False)
-    X_test = np.load(f"{training_files_btc_pct}/X_train_{ticker}.npy")
+    # Full run: resync the state tail_test_main continues from
+    volume = obv_volume(df)
+    save_tail_state(tail_state_path(training_files_btc_pct, ticker), build_tail_state(df, raw_obv(df['close'], volume), volume))
 
+def tail_test_main(ticker, num_preds):
+    """
+    Same predictions as test_main, computed from the tail of the window only (see
+    btc.test_main.tail_test_main). Falls back to test_main when the state of
+    the last full run cannot be continued.
+    """
+    num_preds = int(num_preds)
+    state_path = tail_state_path(training_files_btc_pct, ticker)
 
-    y_pred = (np.expm1(model.predict(X_test, verbose=0)/ scale)).reshape(-1)
-    y_pred= [float(val) for val in y_pred]
+    tail = read_window(ticker, CANDLE_CONSUMER, tail_rows=TAIL_WARMUP_ROWS + sequence_length + num_preds)
+    front_timestamp = window_front(ticker, CANDLE_CONSUMER)
+    resync = obv_offset(load_tail_state(state_path), tail, raw_obv(tail['close'], obv_volume(tail)), front_timestamp)
+    if resync is None:
+        return test_main(ticker, num_preds)
 
-    save_predictions(y_pred, ticker)
+    offset, state = resync
+    predict_and_save(calculate_indicators(tail, obv_offset=offset), ticker, num_preds)
+    save_tail_state(state_path, state)
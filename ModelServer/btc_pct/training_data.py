@@ -3,7 +3,9 @@ import pandas as pd
 from sklearn.preprocessing import RobustScaler
 from sklearn.decomposition import PCA
 import joblib
+from sequences import sequence_starts, sliding_sequences, window_ends
 from consts import training_files_btc_pct
+from model_registry import load_artifacts
 
 features = [
     'ret_lag_1',
@@ -18,52 +20,66 @@ features = [
 ]
 sequence_length = 70
 
-def create_sequences(data, seq_length, num_sequences, has_target=True):
-    X, y = [], []
+def create_sequences(data, feature_values, seq_length, num_sequences, has_target=True):
+    """
+    Builds the last `num_sequences` windows of `seq_length` rows as a strided
+    (num_sequences, seq_length, F) view over `feature_values`, whose rows are
+    aligned with `data`. Also returns, per window, the Target_pct of its last
+    row, or a Sequence/timestamp frame when there is no target.
+    """
+    X = sliding_sequences(feature_values, seq_length, num_sequences)
 
-    for i in range(len(data)- num_sequences - seq_length + 1, len(data) - seq_length + 1):
-        sequence_data = data[i: i + seq_length].copy()
-        sequence_data["Sequence"] = i
-        X.append(sequence_data)
+    if has_target:
+        y = window_ends(data["Target_pct"].to_numpy(), seq_length, num_sequences)
+    else:
+        y = pd.DataFrame({
+            "Sequence": sequence_starts(len(data), seq_length, num_sequences),
+            "timestamp": window_ends(data["timestamp"], seq_length, num_sequences).reset_index(drop=True)
+        })
 
-        if has_target:
-            target_value = data.iloc[i + seq_length - 1]["Target_pct"]
-            target = pd.DataFrame({"Sequence": [i], "Target_pct": [target_value]})
-            y.append(target)
-        else:
-            target_date = data.iloc[i + seq_length -1]["timestamp"]
-            target_date_dataframe = pd.DataFrame({"Sequence": [i],  "timestamp": [target_date]})
-            y.append(target_date_dataframe)
+    return X, y
 
-        if i % 10000 == 0:
-            print(f"{i} iterations completed")
 
-    X = pd.concat(X, axis=0)
-    y = pd.concat(y, ignore_index=True)
+def _load_keras_model(path):
+    from tensorflow.keras.models import load_model # type: ignore
+    return load_model(path, compile=False)
 
-    return X, y
+def load_model_artifacts(ticker):
+    """The LSTM and scaler of the published training run, resident in this worker."""
+    return load_artifacts(training_files_btc_pct, ticker, {
+        'model': (f'model_{ticker}.keras', _load_keras_model),
+        'scaler': (f'scaler_{ticker}.pkl', joblib.load)
+    })
 
+def create_input(data, ticker, num_sequences, has_target=True, save_files=True, artifact_dir=training_files_btc_pct, artifacts=None):
+    """
+    Scales the features and builds the sequences. Returns (X, y): the
+    (N, sequence_length, F) windows and either the targets or, without
+    targets, the Sequence/timestamp frame of each window. With `save_files`
+    the arrays are also written to training_files for training.
 
-def create_input(data, ticker, num_sequences, has_target=True):
+    With targets the fitted scaler goes to `artifact_dir`, the staged
+    directory of the training run. Without, it comes from `artifacts`
+    (see load_model_artifacts), so it matches the LSTM that gets the windows.
+    """
     if has_target:
         scaler = RobustScaler()
         data[features] = scaler.fit_transform(data[features])
-        joblib.dump(scaler, f'{training_files_btc_pct}/scaler_{ticker}.pkl')
+        joblib.dump(scaler, f'{artifact_dir}/scaler_{ticker}.pkl')
     else:
-        scaler = joblib.load(f'{training_files_btc_pct}/scaler_{ticker}.pkl')
+        scaler = (artifacts or load_model_artifacts(ticker))['scaler']
         data[features] = scaler.transform(data[features])
 
 
-    X_data, y_data = create_sequences(data, sequence_length, num_sequences, has_target)
-    combined_data = X_data[features]
+    X_array, y_data = create_sequences(data, data[features].to_numpy(), sequence_length, num_sequences, has_target)
 
-    if has_target:
-        combined_target_data = y_data['Target_pct']
-        y_array = np.array(combined_target_data.values.reshape(-1))
-        np.save(f'{training_files_btc_pct}/y_train_{ticker}.npy', y_array)
-    else:
-        y_data.to_csv(f"{training_files_btc_pct}/timestamps_{ticker}.csv")
+    if save_files:
+        if has_target:
+            np.save(f'{training_files_btc_pct}/y_train_{ticker}.npy', y_data)
+        else:
+            y_data.to_csv(f"{training_files_btc_pct}/timestamps_{ticker}.csv")
 
-    X_array = np.array(combined_data.values.reshape(-1, sequence_length, len(features)))
-    np.save(f'{training_files_btc_pct}/X_train_{ticker}.npy', X_array)
+        # np.save writes the strided windows in C order, so the file matches a contiguous copy
+        np.save(f'{training_files_btc_pct}/X_train_{ticker}.npy', X_array)
 
+    return X_array, y_data
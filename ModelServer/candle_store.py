@@ -0,0 +1,204 @@
+import os
+import time
+import fcntl
+from contextlib import contextmanager
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from binance.client import Client
+from consts import CANDLE_STORE_DIR, CANDLE_WINDOW_ROWS
+
+# One fixed-width record per 5-minute candle, in the column order of the Binance
+# klines (and of the {ticker}_24k.csv files the store replaces). The file is a
+# bare array of these records: row i starts at byte i * itemsize.
+CANDLE_DTYPE = np.dtype([
+    ('timestamp', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+    ('volume', '<f8'), ('close_time', '<i8'), ('quote_asset_volume', '<f8'), ('num_trades', '<f8'),
+    ('taker_buy_base_volume', '<f8'), ('taker_buy_quote_volume', '<f8'), ('ignore', '<i8')
+])
+CANDLE_COLUMNS = list(CANDLE_DTYPE.names)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+INTERVAL_MS = 5 * 60 * 1000
+# Candles fetched per poll: the hour the CSV updater used to request
+FETCH_ROWS = 12
+
+def store_path(ticker):
+    return os.path.join(CANDLE_STORE_DIR, f'{ticker}_5m.bin')
+
+def cursor_path(ticker, consumer):
+    return os.path.join(CANDLE_STORE_DIR, f'{ticker}_5m.{consumer}.cursor')
+
+@contextmanager
+def store_lock(ticker):
+    """Serializes writers of one ticker's store across processes."""
+    os.makedirs(CANDLE_STORE_DIR, exist_ok=True)
+    with open(os.path.join(CANDLE_STORE_DIR, f'{ticker}_5m.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def open_candles(ticker):
+    """Read-only memory map of every complete record in the store (empty when there is none)."""
+    path = store_path(ticker)
+    num_rows = os.path.getsize(path) // CANDLE_DTYPE.itemsize if os.path.exists(path) else 0
+    if num_rows == 0:
+        return np.empty(0, dtype=CANDLE_DTYPE)
+    return np.memmap(path, dtype=CANDLE_DTYPE, mode='r', shape=(num_rows,))
+
+def timestamp_ms(timestamps):
+    """Epoch milliseconds of timestamp strings or datetimes, scalar or array."""
+    return np.asarray(pd.to_datetime(timestamps)).astype('datetime64[ms]').view('<i8')
+
+def frame_to_candles(df):
+    """Records of a candle DataFrame; `timestamp` may be strings or datetimes."""
+    candles = np.empty(len(df), dtype=CANDLE_DTYPE)
+    candles['timestamp'] = timestamp_ms(df['timestamp'])
+    for column in CANDLE_COLUMNS[1:]:
+        candles[column] = df[column].to_numpy()
+    return candles
+
+def candles_to_frame(candles):
+    """
+    The DataFrame pd.read_csv used to return for these rows of a
+    {ticker}_24k.csv, timestamps as strings included. Copies out of the map.
+    """
+    df = pd.DataFrame({column: np.array(candles[column]) for column in CANDLE_COLUMNS})
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms').dt.strftime(TIMESTAMP_FORMAT)
+    return df
+
+def append_candles(ticker, candles):
+    """
+    Appends the records newer than the last stored candle; older ones are
+    dropped, so overlapping fetches and repeated imports are harmless. Returns
+    the number of rows written.
+    """
+    with store_lock(ticker):
+        stored = open_candles(ticker)
+        if len(stored):
+            candles = candles[candles['timestamp'] > stored['timestamp'][-1]]
+        if len(candles) == 0:
+            return 0
+
+        with open(store_path(ticker), 'ab') as f:
+            # Cut a record left half-written by a crash before appending after it
+            f.truncate(len(stored) * CANDLE_DTYPE.itemsize)
+            f.write(np.ascontiguousarray(candles).tobytes())
+        return len(candles)
+
+def read_cursor(ticker, consumer):
+    """Timestamp (ms) of the last candle `consumer` has processed, or None."""
+    path = cursor_path(ticker, consumer)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return int(f.read())
+
+def write_cursor(ticker, consumer, timestamp):
+    path = cursor_path(ticker, consumer)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(str(int(timestamp)))
+    os.replace(tmp_path, path)
+
+def cursor_end(candles, cursor):
+    """Index one past the consumer's last processed candle; the whole store without a cursor."""
+    if cursor is None:
+        return len(candles)
+    return int(np.searchsorted(candles['timestamp'], cursor, side='right'))
+
+def read_window(ticker, consumer, rows=CANDLE_WINDOW_ROWS, tail_rows=None):
+    """
+    The rolling window a model pipeline sees: the last `rows` candles up to the
+    consumer's cursor, or only the last `tail_rows` of them.
+    """
+    candles = open_candles(ticker)
+    end = cursor_end(candles, read_cursor(ticker, consumer))
+    start = max(end - rows, 0)
+    if tail_rows is not None:
+        start = max(end - tail_rows, start)
+    return candles_to_frame(candles[start:end])
+
+def window_front(ticker, consumer, rows=CANDLE_WINDOW_ROWS):
+    """Timestamp string of the first candle of the consumer's window."""
+    candles = open_candles(ticker)
+    end = cursor_end(candles, read_cursor(ticker, consumer))
+    return candles_to_frame(candles[max(end - rows, 0):end][:1])['timestamp'].iloc[0]
+
+def fetch_candles(ticker, start_ms, num_rows=FETCH_ROWS):
+    """Up to `num_rows` 5-minute klines from Binance starting at `start_ms`, retrying until the request succeeds."""
+    client = Client()
+    start_time = pd.to_datetime(start_ms, unit='ms')
+    end_time = start_time + timedelta(minutes=5 * (num_rows - 1))
+
+    while True:
+        try:
+            new_klines = client.get_historical_klines(
+                f"{ticker}USDT",
+                Client.KLINE_INTERVAL_5MINUTE,
+                start_str=start_time.strftime("%d %b, %Y %H:%M:%S"),
+                end_str=end_time.strftime("%d %b, %Y %H:%M:%S")
+            )
+            new_df = pd.DataFrame(new_klines, columns=CANDLE_COLUMNS)
+            new_df["timestamp"] = pd.to_datetime(new_df["timestamp"], unit="ms")
+            numeric_cols = ["open", "high", "low", "close", "volume",
+                            "quote_asset_volume", "num_trades",
+                            "taker_buy_base_volume", "taker_buy_quote_volume"]
+            new_df[numeric_cols] = new_df[numeric_cols].astype(float)
+            new_df.dropna(inplace=True)
+            return frame_to_candles(new_df)
+
+        except Exception as e:
+            print("Error fetching new klines:", e, flush=True)
+            print("Retrying in 15 seconds...", flush=True)
+            time.sleep(15)
+
+def import_csv(ticker, csv_path):
+    """
+    Seeds the store from a legacy {ticker}_24k.csv; rows already stored are
+    skipped, so importing again is harmless. Returns the CSV's records.
+    """
+    candles = frame_to_candles(pd.read_csv(csv_path).dropna())
+    append_candles(ticker, candles)
+    return candles
+
+def advance_consumer(ticker, consumer, bootstrap_csv=None, max_rows=FETCH_ROWS):
+    """
+    Moves `consumer`'s cursor over the next candles it has not processed,
+    fetching them from Binance only when the store has nothing past the
+    cursor yet. A consumer without a cursor first imports `bootstrap_csv`
+    and resumes where it ended. Returns (count, latest_timestamp) like the
+    CSV updater did: (0, None) once the consumer is up to date.
+    """
+    cursor = read_cursor(ticker, consumer)
+    seed = None
+    if cursor is None and bootstrap_csv and os.path.exists(bootstrap_csv):
+        # Every consumer imports its own CSV, so its cursor never lands past the end of the store
+        seed = import_csv(ticker, bootstrap_csv)
+
+    candles = open_candles(ticker)
+    if len(candles) == 0:
+        return 0, None
+
+    if cursor is None:
+        # A new consumer resumes where its CSV ended, or from the newest stored candle
+        cursor = int(seed['timestamp'][-1]) if seed is not None and len(seed) else int(candles['timestamp'][-1])
+        write_cursor(ticker, consumer, cursor)
+
+    end = cursor_end(candles, cursor)
+    if end == len(candles):
+        # Fetched outside the lock, so a Binance outage does not stall the other
+        # pipeline; append_candles skips whatever it stored in the meantime
+        append_candles(ticker, fetch_candles(ticker, int(candles['timestamp'][-1]) + INTERVAL_MS, max_rows))
+        candles = open_candles(ticker)
+        # Searched again so rows at or before the cursor are never handed out twice
+        end = cursor_end(candles, cursor)
+
+    new_candles = candles[end:end + max_rows]
+    if len(new_candles) == 0:
+        return 0, None
+
+    latest_ms = int(new_candles['timestamp'][-1])
+    write_cursor(ticker, consumer, latest_ms)
+    return len(new_candles), pd.Timestamp(latest_ms, unit='ms', tz='UTC')
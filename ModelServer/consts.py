@@ -3,4 +3,8 @@ import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 training_files_btc = os.path.join(BASE_DIR, 'btc','training_files')
 training_files_btc_pct = os.path.join(BASE_DIR, 'btc_pct','training_files')
-STOCK_SYMBOLS = ["BTC", "ETH", "LTC"]
\ No newline at end of file
+STOCK_SYMBOLS = ["BTC", "ETH", "LTC"]
+# Shared append-only 5-minute candle store read by both model pipelines
+CANDLE_STORE_DIR = os.environ.get('CANDLE_STORE_DIR', os.path.join(BASE_DIR, 'candle_store'))
+# Candles in the rolling window a pipeline trains and predicts on (the old {ticker}_24k.csv)
+CANDLE_WINDOW_ROWS = 24000
@@ -43,6 +43,8 @@ def sync_ohlc_data(tickers):
 
         binary_collection = db[binary_collection_name]
         ohlc_collection = db[ohlc_collection_name]
+        # No-op once it exists; covers collections created after mongo-init ran
+        ohlc_collection.create_index("timestamp")
         
         # 1. ## DETERMINE THE DATE RANGE BASED ON THE BINARY COLLECTION ##
         # Find the absolute earliest and latest timestamps in the source of truth: the binary collection.
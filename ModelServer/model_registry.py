@@ -0,0 +1,94 @@
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+
+# Every training run writes its model, scaler and PCA into a new directory
+# {training_files}/artifacts/{ticker}/{version}/ and only then publishes it by
+# replacing the CURRENT pointer file, so a worker always switches to a
+# complete set from one run. Until the first publish, the flat files in
+# training_files (written by the init scripts) are the live set.
+ARTIFACTS_DIR = 'artifacts'
+POINTER_FILE = 'CURRENT'
+# Published versions kept on disk: the live one and the one before it.
+ARTIFACT_VERSIONS_KEPT = 2
+
+# Sets loaded by this worker process: (folder, ticker, names) -> (version key, {name: object}).
+# Each Celery worker process keeps its own.
+_artifact_sets = {}
+_lock = threading.Lock()
+
+def _ticker_root(folder, ticker):
+    return os.path.join(folder, ARTIFACTS_DIR, ticker)
+
+def current_version(folder, ticker):
+    """The published version of `ticker`'s artifacts, or None while the flat files are live."""
+    try:
+        with open(os.path.join(_ticker_root(folder, ticker), POINTER_FILE), 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def version_dir(folder, ticker, version):
+    """Directory holding the files of `version`; the flat training_files folder for None."""
+    return folder if version is None else os.path.join(_ticker_root(folder, ticker), version)
+
+def artifact_stamp(path):
+    """Changes whenever the file is replaced: os.replace gives it a new inode, rewrites a new mtime or size."""
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def load_artifacts(folder, ticker, files):
+    """
+    {name: object} for `files` ({name: (file name, loader)}), all taken from
+    the published version. The set is loaded once per process and swapped as
+    a whole when the pointer moves. If the new version fails to load, the
+    resident set keeps serving.
+    """
+    version = current_version(folder, ticker)
+    directory = version_dir(folder, ticker, version)
+    paths = {name: os.path.join(directory, file_name) for name, (file_name, _) in files.items()}
+    # The flat files have no version: their stamps stand in for one
+    key = version if version is not None else tuple(artifact_stamp(path) for path in paths.values())
+
+    cache_key = (folder, ticker, tuple(sorted(files)))
+    with _lock:
+        entry = _artifact_sets.get(cache_key)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    try:
+        artifacts = {name: loader(paths[name]) for name, (_, loader) in files.items()}
+    except Exception as e:
+        if entry is None:
+            raise
+        print(f"Keeping the loaded {ticker} artifacts, loading {directory} failed: {e}", flush=True)
+        return entry[1]
+
+    with _lock:
+        _artifact_sets[cache_key] = (key, artifacts)
+    return artifacts
+
+def stage_artifacts(folder, ticker):
+    """Creates the empty, unpublished directory of a new training run. Returns (version, directory)."""
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    directory = version_dir(folder, ticker, version)
+    os.makedirs(directory)
+    return version, directory
+
+def publish_artifacts(folder, ticker, version):
+    """
+    Makes `version` the live set with one os.replace of the pointer file,
+    then removes the versions older than the last ARTIFACT_VERSIONS_KEPT,
+    including runs that were staged but never published.
+    """
+    root = _ticker_root(folder, ticker)
+    tmp_path = os.path.join(root, f'{POINTER_FILE}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(root, POINTER_FILE))
+
+    # Version names sort chronologically; newer ones may be runs still being staged
+    older = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)) and name <= version)
+    for name in older[:-ARTIFACT_VERSIONS_KEPT]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
@@ -0,0 +1,27 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+def sequence_starts(num_rows, seq_length, num_sequences):
+    """Row range of the first rows of the last `num_sequences` windows of `seq_length` rows."""
+    first = num_rows - num_sequences - seq_length + 1
+    if num_sequences <= 0 or first < 0:
+        raise ValueError(f"Cannot build {num_sequences} sequences of {seq_length} rows from {num_rows} rows.")
+    return range(first, num_rows - seq_length + 1)
+
+def sliding_sequences(values, seq_length, num_sequences):
+    """
+    (num_sequences, seq_length, F) windows over the rows of the 2-D `values`,
+    ending on its last row. The result is a strided view: nothing is copied
+    until a consumer needs contiguous memory.
+    """
+    starts = sequence_starts(len(values), seq_length, num_sequences)
+    windows = sliding_window_view(values, seq_length, axis=0) # (rows - seq_length + 1, F, seq_length)
+    return windows[starts.start:starts.stop].transpose(0, 2, 1)
+
+def window_ends(values, seq_length, num_sequences):
+    """
+    The entries of the array or Series `values` aligned with the last row of
+    each window, e.g. targets or timestamps. Slicing keeps it a view.
+    """
+    starts = sequence_starts(len(values), seq_length, num_sequences)
+    return getattr(values, 'iloc', values)[starts.start + seq_length - 1:]
@@ -0,0 +1,78 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from ta.volume import OnBalanceVolumeIndicator
+
+# Rows read before the first row a new sequence needs. The EMA-based indicators
+# (RSI, MACD, ATR, EMAs) forget their seed at (1 - alpha)^rows, which is far
+# below float precision after this many rows; rolling windows need much less.
+TAIL_WARMUP_ROWS = 500
+# First rows of the window remembered at each full run. The window rolls
+# forward with every update, and OBV is cumulative from its first row, so
+# rebasing OBV after the front rolls forward needs the rows that were dropped. Once these run out the next
+# update does a full run again.
+HEAD_ROWS = 288
+
+def raw_obv(close, volume):
+    """OBV exactly as ta computes it: cumulative from the first row of the frame, before any abs()."""
+    return OnBalanceVolumeIndicator(close=close, volume=volume).on_balance_volume().to_numpy()
+
+def tail_state_path(folder, ticker):
+    return os.path.join(folder, f'tail_state_{ticker}.json')
+
+def load_tail_state(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_tail_state(path, state):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def build_tail_state(df, obv, volume):
+    """
+    State after a full run over `df` (the frame OBV was computed on): the OBV
+    of its last row and the timestamp, OBV and volume of its first HEAD_ROWS.
+    """
+    head = slice(0, HEAD_ROWS)
+    return {
+        'last_timestamp': str(df['timestamp'].iloc[-1]),
+        'obv': float(obv[-1]),
+        'head': {
+            'timestamp': [str(ts) for ts in df['timestamp'].iloc[head]],
+            'obv': [float(value) for value in obv[head]],
+            'volume': [float(value) for value in np.asarray(volume)[head]]
+        }
+    }
+
+def obv_offset(state, tail, tail_obv, front_timestamp):
+    """
+    Returns (offset, new_state): the constant that turns the OBV computed on
+    `tail` into the OBV of a full run over the whole window, whose first row is
+    now `front_timestamp`, and the state advanced to the end of `tail`.
+    Returns None when the state cannot bridge the gap and a full run is needed.
+    """
+    if state is None:
+        return None
+
+    timestamps = tail['timestamp'].astype(str).tolist()
+    head_timestamps = state['head']['timestamp']
+    if state['last_timestamp'] not in timestamps or str(front_timestamp) not in head_timestamps:
+        return None
+
+    # OBV in the frame of the last full run (cumulative from its first row)
+    to_state_frame = state['obv'] - tail_obv[timestamps.index(state['last_timestamp'])]
+
+    # A full run now starts its cumulative sum at the current first row, with that row counted as +volume
+    front = head_timestamps.index(str(front_timestamp))
+    front_obv = state['head']['obv'][front] - state['head']['volume'][front]
+
+    new_state = dict(state, last_timestamp=timestamps[-1], obv=float(tail_obv[-1] + to_state_frame))
+    return to_state_frame - front_obv, new_state
@@ -2,50 +2,21 @@ import sys, os
 from flask import Flask, request
 from flask_cors import CORS
 from flask_socketio import SocketIO
-from celery import Celery, Task
-import json
+from celery import Celery, Task, group
+from celery.signals import worker_process_init
 
-from src.recommendation import recommend
-from src.get_data import fetch_and_prepare_single_stock
-from src.backtest_engine import run_buy_and_hold_policy, run_rl_policy, run_xgBoost_policy, run_lstm_policy, save_best_strategy_params
+from src.recommendation import recommend, recommend_batch
+from src.recommendation_batch import enqueue_request, drain_requests, RECOMMENDATION_BATCH_WINDOW
+from src.feature_cache import get_featured_stock_frame
+from src.backtest_engine import buy_and_hold_path, rl_policy_path, xgboost_policy_path, lstm_policy_path
+from src.metrics import summarize_policy
+from src.costs import resolve_cost_model
+from src.calibration import get_strategy_params, calibrate_stock, clear_calibration_requests, CALIBRATION_INTERVAL
+from src.walk_forward import run_walk_forward, WALK_FORWARD_TRAIN_DAYS, WALK_FORWARD_TEST_DAYS
+from src.portfolio import run_portfolio_backtest, ALLOCATION_RULES, DEFAULT_ALLOCATION_RULE
+from src.model_registry import get_policy
 from consts import final_feature_columns, AVAILABLE_STOCKS
 
-# =================================================================
-# 0. Pre Loading Policies Best Params
-# =================================================================
-
-STRATEGY_CONFIG = None
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_PATH = os.path.join(BASE_DIR, 'src', 'strategy_config.json')
-
-try:
-    print(f">>> Attempting to load strategy config from: {CONFIG_PATH}", flush=True)
-    with open(CONFIG_PATH, 'r') as f:
-        STRATEGY_CONFIG = json.load(f)
-    print(">>> Strategy config loaded successfully from file. <<<", flush=True)
-
-except FileNotFoundError:
-    print(f"!!! WARNING: Config file not found at {CONFIG_PATH}. Generating a new one now...", flush=True)
-    print("!!! This may take up to a minute. The service will be unresponsive during this time. !!!", flush=True)
-    
-    try:
-        STRATEGY_CONFIG = save_best_strategy_params()
-
-    except Exception as e:
-        print(f"!!! FATAL ERROR: Failed during on-demand config generation. Reason: {e} !!!", flush=True)
-        # We exit here because the service cannot function without the config.
-        sys.exit(1)
-
-except Exception as e:
-    # This catches other errors like JSON decoding errors, permission errors etc.
-    print(f"!!! FATAL ERROR: Could not load or parse config file. Reason: {e} !!!", flush=True)
-    sys.exit(1)
-
-# A final check to ensure the config was loaded one way or another
-if STRATEGY_CONFIG is None:
-    print("!!! FATAL ERROR: Strategy config is still None after startup. Exiting. !!!", flush=True)
-    sys.exit(1)
-
 # =================================================================
 # 1. FLASK, CELERY, SOCKET.IO INITIALIZATION
 # =================================================================
@@ -68,9 +39,20 @@ app.config.from_mapping(
         broker_url=os.environ.get("CELERY_BROKER_URL"),
         result_backend=os.environ.get("CELERY_RESULT_BACKEND"),
         task_ignore_result=True, # We send results via Socket.IO, not the backend
+        beat_schedule={
+            'calibrate-strategies': {
+                'task': 'app.calibrate_strategies_task',
+                'schedule': CALIBRATION_INTERVAL,
+            },
+        },
         task_routes={
             'app.generate_recommendation_task': {'queue': 'recommendation_queue'},
+            'app.flush_recommendations_task': {'queue': 'recommendation_queue'},
             'app.run_backtest_task': {'queue': 'recommendation_queue'},
+            'app.calibrate_strategies_task': {'queue': 'recommendation_queue'},
+            'app.calibrate_stock_task': {'queue': 'recommendation_queue'},
+            'app.walk_forward_task': {'queue': 'recommendation_queue'},
+            'app.run_portfolio_backtest_task': {'queue': 'recommendation_queue'},
         },
     ),
 )
@@ -81,86 +63,132 @@ celery = celery_init_app(app)
 
 print("RECOMMENDATION-SERVICE: Initializing...", flush=True)
 
+@worker_process_init.connect
+def preload_policy(**kwargs):
+    """Warms the model registry once per worker process so the first request does not pay for SAC.load."""
+    try:
+        get_policy()
+    except Exception as e:
+        print(f"WORKER: Could not preload SAC policy. It will be loaded on first use. Reason: {e}", flush=True)
+
 
 # =================================================================
 # 2. DEFINE THE CELERY BACKGROUND TASK
 # =================================================================
+def emit_recommendation(stock_symbol, recommendation_result, user_sid):
+    """Sends a recommendation dict, or the exception that prevented it, to one client."""
+    if isinstance(recommendation_result, Exception):
+        print(f"WORKER: FAILED for {stock_symbol}. Reason: {recommendation_result}", flush=True)
+        socketio.emit('recommendation_result', {
+            'status': 'error',
+            'message': str(recommendation_result)
+        }, room=user_sid)
+        return
+
+    print(f"WORKER: Success for {stock_symbol}. Emitting result to SID {user_sid}", flush=True)
+    socketio.emit('recommendation_result', {
+        'status': 'success',
+        'data': recommendation_result
+    }, room=user_sid)
+
 @celery.task(bind=True)
 def generate_recommendation_task(self, stock_symbol, initial_balance, initial_shares_held, user_sid):
     """
-    This background task runs in the worker process. It performs the slow
-    recommendation logic and emits the result directly back to the user.
+    This background task runs in the worker process. It queues the request
+    into the current micro-batch (opening a new one if needed); the batch is
+    answered by flush_recommendations_task. Without Redis it runs the
+    recommendation directly and emits the result back to the user.
     """
     print(f"WORKER: Starting recommendation for {stock_symbol} with initial balnce of: {initial_balance} and initial stock share of: {initial_shares_held} (Task ID: {self.request.id})", flush=True)
+
+    opened_batch = enqueue_request({
+        'stock_symbol': stock_symbol,
+        'initial_balance': initial_balance,
+        'initial_shares_held': initial_shares_held,
+        'user_sid': user_sid
+    })
+    if opened_batch is not None:
+        if opened_batch:
+            flush_recommendations_task.apply_async(countdown=RECOMMENDATION_BATCH_WINDOW)
+        return {'status': 'queued'}
+
     try:
         recommendation_result = recommend(stock_symbol, initial_balance, initial_shares_held)
         
         if recommendation_result is None:
             raise ValueError("The recommend() function returned None, indicating a data or processing error.")
-            
-        print(f"WORKER: Success for {stock_symbol}. Emitting result to SID {user_sid}", flush=True)
-        socketio.emit('recommendation_result', {
-            'status': 'success',
-            'data': recommendation_result
-        }, room=user_sid)
 
+        emit_recommendation(stock_symbol, recommendation_result, user_sid)
         return {'status': 'success'}
 
     except Exception as e:
-        print(f"WORKER: FAILED for {stock_symbol}. Reason: {e}", flush=True)
-        socketio.emit('recommendation_result', {
-            'status': 'error',
-            'message': str(e)
-        }, room=user_sid)
+        emit_recommendation(stock_symbol, e, user_sid)
         raise
 
+@celery.task
+def flush_recommendations_task():
+    """Answers every request queued during the batch window with one policy forward pass."""
+    requests = drain_requests()
+    if not requests:
+        return {'status': 'empty'}
+
+    print(f"WORKER: Flushing a batch of {len(requests)} recommendation requests", flush=True)
+    try:
+        results = recommend_batch(requests)
+    except Exception as e:
+        results = [e] * len(requests)
+
+    for req, recommendation_result in zip(requests, results):
+        emit_recommendation(req['stock_symbol'], recommendation_result, req['user_sid'])
+
+    return {'status': 'success', 'batch_size': len(requests)}
+
 @celery.task(bind=True)
-def run_backtest_task(self, stock, start_date, end_date, user_sid):
+def run_backtest_task(self, stock, start_date, end_date, user_sid, cost_model=None):
     """Celery task to run the full backtest simulation."""
     print(f"BACKTEST WORKER: Starting for {stock} (Task ID: {self.request.id})", flush=True)
     try:
-        raw_df = fetch_and_prepare_single_stock(start_date, end_date, stock=stock)
-        rl_df = raw_df.reindex(columns=final_feature_columns).dropna().reset_index(drop=True)
+        # Every policy trades under the same fees, spread and slippage
+        cost_model = resolve_cost_model(cost_model)
+
+        raw_df = get_featured_stock_frame(start_date, end_date, stock=stock)
+        feature_df = raw_df.reindex(columns=final_feature_columns)
+        feature_mask = feature_df.notna().all(axis=1)
+        rl_df = feature_df[feature_mask].reset_index(drop=True)
+        rl_timestamps = raw_df.loc[feature_mask, 'timestamp'].to_numpy()
+        rl_volume = raw_df.loc[feature_mask, 'volume'].to_numpy(dtype=float)
+        timestamps = raw_df['timestamp'].to_numpy()
 
         if rl_df.empty:
             raise ValueError("Not enough data for the selected range after cleaning.")
 
         initial_balance = 10000
-        buy_and_hold_result = run_buy_and_hold_policy(raw_df.copy(), initial_balance)
-        rl_policy_result = run_rl_policy(rl_df.copy(), initial_balance)
+        buy_and_hold_result = buy_and_hold_path(raw_df, initial_balance, cost_model)
+        rl_policy_result = rl_policy_path(rl_df, initial_balance, cost_model, rl_volume)
 
-        # Get the pre-optimized parameters for the XGBoost policy
-        stock_params = STRATEGY_CONFIG[stock]
+        # Get the pre-optimized parameters for the XGBoost policy (loaded lazily from the calibration store)
+        stock_params = get_strategy_params(stock) or {}
         xgb_params = stock_params.get('xgboost_policy')
         if not xgb_params:
-            raise ValueError("XGBoost strategy parameters not found in config.")
+            raise ValueError(f"XGBoost strategy parameters for {stock} are not calibrated yet. A calibration has been queued, try again later.")
 
-        xgboost_policy_result = run_xgBoost_policy(
-            raw_df.copy(), 
+        xgboost_policy_result = xgboost_policy_path(
+            raw_df, 
             initial_balance,
             threshold=xgb_params['threshold'],
-            percentage_to_act=xgb_params['percentage'])
+            percentage_to_act=xgb_params['percentage'],
+            cost_model=cost_model)
         
-        lstm_policy_result = run_lstm_policy(raw_df.copy(), initial_balance)
+        lstm_policy_result = lstm_policy_path(raw_df, initial_balance, cost_model=cost_model)
         
+        # Each policy block carries finalValue/profit as before, plus metrics and a downsampled equity curve
         results = {
             "initialBalance": initial_balance,
-            "buyAndHold": {
-                "finalValue": buy_and_hold_result,
-                "profit": buy_and_hold_result - initial_balance
-            },
-            "rlPolicy": {
-                "finalValue": rl_policy_result,
-                "profit": rl_policy_result - initial_balance
-            },
-            "xgPolicy": {
-                "finalValue": xgboost_policy_result,
-                "profit": xgboost_policy_result - initial_balance
-            },
-            "lstmPolicy": {
-                "finalValue": lstm_policy_result,
-                "profit": lstm_policy_result - initial_balance
-            }
+            "costModel": cost_model,
+            "buyAndHold": summarize_policy(buy_and_hold_result, initial_balance, timestamps),
+            "rlPolicy": summarize_policy(rl_policy_result, initial_balance, rl_timestamps),
+            "xgPolicy": summarize_policy(xgboost_policy_result, initial_balance, timestamps),
+            "lstmPolicy": summarize_policy(lstm_policy_result, initial_balance, timestamps)
         }
         
         print(f"BACKTEST WORKER: Success for {stock}. Emitting result to {user_sid}", flush=True)
@@ -172,6 +200,62 @@ def run_backtest_task(self, stock, start_date, end_date, user_sid):
         socketio.emit('backtest_result', {'status': 'error', 'message': str(e)}, room=user_sid)
         raise
 
+@celery.task(bind=True)
+def run_portfolio_backtest_task(self, start_date, end_date, user_sid, stocks=None, allocation_rule=DEFAULT_ALLOCATION_RULE, cost_model=None):
+    """Celery task to backtest the XGBoost policy on several stocks sharing one cash balance."""
+    stocks = stocks or AVAILABLE_STOCKS
+    print(f"PORTFOLIO WORKER: Starting for {stocks} (Task ID: {self.request.id})", flush=True)
+    try:
+        results = run_portfolio_backtest(start_date, end_date, stocks, allocation_rule, cost_model=cost_model)
+
+        print(f"PORTFOLIO WORKER: Success for {stocks}. Emitting result to {user_sid}", flush=True)
+        socketio.emit('portfolio_backtest_result', {'status': 'success', 'data': results}, room=user_sid)
+        return {'status': 'success'}
+
+    except Exception as e:
+        print(f"PORTFOLIO WORKER: FAILED for {stocks}. Reason: {e}", flush=True)
+        socketio.emit('portfolio_backtest_result', {'status': 'error', 'message': str(e)}, room=user_sid)
+        raise
+
+@celery.task
+def calibrate_strategies_task(stocks=None):
+    """
+    Re-fits the XGBoost policy parameters of every stock. Run by beat every
+    CALIBRATION_INTERVAL; fans out one calibrate_stock_task per stock so the
+    stocks are calibrated in parallel across the workers.
+    """
+    stocks = stocks or AVAILABLE_STOCKS
+    print(f"CALIBRATION WORKER: Queuing calibrations for {stocks}", flush=True)
+    group(calibrate_stock_task.s(stock) for stock in stocks).apply_async()
+
+@celery.task
+def calibrate_stock_task(stock):
+    """Re-fits one stock's XGBoost policy parameters and stores a new calibration version. Queued by get_strategy_params on a miss."""
+    print(f"CALIBRATION WORKER: Starting for {stock}", flush=True)
+    try:
+        params = calibrate_stock(stock)
+    finally:
+        clear_calibration_requests([stock])
+    print(f"CALIBRATION WORKER: Done for {stock}. {params}", flush=True)
+    return params
+
+@celery.task(bind=True)
+def walk_forward_task(self, stock, start_date, end_date, user_sid, train_days=WALK_FORWARD_TRAIN_DAYS,
+                      test_days=WALK_FORWARD_TEST_DAYS, cost_model=None):
+    """Celery task that re-fits the XGBoost policy on rolling windows and reports the out-of-sample result."""
+    print(f"WALK-FORWARD WORKER: Starting for {stock} (Task ID: {self.request.id})", flush=True)
+    try:
+        results = run_walk_forward(stock, start_date, end_date, train_days, test_days, cost_model=cost_model)
+
+        print(f"WALK-FORWARD WORKER: Success for {stock}. Emitting result to {user_sid}", flush=True)
+        socketio.emit('walk_forward_result', {'status': 'success', 'data': results}, room=user_sid)
+        return {'status': 'success'}
+
+    except Exception as e:
+        print(f"WALK-FORWARD WORKER: FAILED for {stock}. Reason: {e}", flush=True)
+        socketio.emit('walk_forward_result', {'status': 'error', 'message': str(e)}, room=user_sid)
+        raise
+
 # =================================================================
 # 3. DEFINE THE SOCKET.IO EVENT HANDLER
 # =================================================================
@@ -218,11 +302,79 @@ def handle_backtest_request(data):
         socketio.emit('backtest_result', {'status': 'error', 'message': 'Missing parameters.'}, room=user_sid)
         return
         
+    # Optional: a preset name from src.costs.COST_MODELS or a dict of fee/spread/slippage rates in bps
+    cost_model = data.get('cost_model')
+    try:
+        resolve_cost_model(cost_model)
+    except ValueError as e:
+        socketio.emit('backtest_result', {'status': 'error', 'message': str(e)}, room=user_sid)
+        return
+
     # Delegate to the worker
-    run_backtest_task.delay(stock, start_date, end_date, user_sid)
+    run_backtest_task.delay(stock, start_date, end_date, user_sid, cost_model)
     
     socketio.emit('backtest_pending', {'message': f'Backtest for {stock} has started...'})
 
+@socketio.on('request_portfolio_backtest')
+def handle_portfolio_backtest_request(data):
+    user_sid = request.sid
+    print(f"FLASK: Received 'request_portfolio_backtest' from SID {user_sid} for data: {data}", flush=True)
+
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+
+    if not all([start_date, end_date]):
+        socketio.emit('portfolio_backtest_result', {'status': 'error', 'message': 'Missing parameters.'}, room=user_sid)
+        return
+
+    stocks = [stock.upper() for stock in data.get('stocks') or AVAILABLE_STOCKS]
+    allocation_rule = data.get('allocation_rule', DEFAULT_ALLOCATION_RULE)
+    cost_model = data.get('cost_model')
+    try:
+        unknown = [stock for stock in stocks if stock not in AVAILABLE_STOCKS]
+        if unknown:
+            raise ValueError(f"Unknown stocks: {unknown}")
+        if allocation_rule not in ALLOCATION_RULES:
+            raise ValueError(f"Unknown allocation rule '{allocation_rule}'. Available: {list(ALLOCATION_RULES)}")
+        resolve_cost_model(cost_model)
+    except ValueError as e:
+        socketio.emit('portfolio_backtest_result', {'status': 'error', 'message': str(e)}, room=user_sid)
+        return
+
+    # Delegate to the worker
+    run_portfolio_backtest_task.delay(start_date, end_date, user_sid, stocks, allocation_rule, cost_model)
+
+    socketio.emit('portfolio_backtest_pending', {'message': f'Portfolio backtest for {stocks} has started...'})
+
+@socketio.on('request_walk_forward')
+def handle_walk_forward_request(data):
+    user_sid = request.sid
+    print(f"FLASK: Received 'request_walk_forward' from SID {user_sid} for data: {data}", flush=True)
+
+    stock = data.get('stock')
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+
+    if not all([stock, start_date, end_date]):
+        socketio.emit('walk_forward_result', {'status': 'error', 'message': 'Missing parameters.'}, room=user_sid)
+        return
+
+    cost_model = data.get('cost_model')
+    try:
+        resolve_cost_model(cost_model)
+        train_days = int(data.get('train_days', WALK_FORWARD_TRAIN_DAYS))
+        test_days = int(data.get('test_days', WALK_FORWARD_TEST_DAYS))
+        if train_days <= 0 or test_days <= 0:
+            raise ValueError("train_days and test_days must be positive.")
+    except (TypeError, ValueError) as e:
+        socketio.emit('walk_forward_result', {'status': 'error', 'message': str(e)}, room=user_sid)
+        return
+
+    # Delegate to the worker
+    walk_forward_task.delay(stock, start_date, end_date, user_sid, train_days, test_days, cost_model)
+
+    socketio.emit('walk_forward_pending', {'message': f'Walk-forward for {stock} has started...'})
+
 @socketio.on('connect')
 def handle_connect():
     print('RECOMMENDATION-SERVICE: Client connected.', flush=True)
\ No newline at end of file
@@ -1,53 +1,108 @@
 import pandas as pd
-from stable_baselines3 import SAC
 import os
 import numpy as np
 from datetime import datetime
 import json
 
 from src.environment import define_env
-from src.get_data import fetch_and_prepare_single_stock
-from consts import AVAILABLE_STOCKS as stocks_to_train
+from src.get_data import fetch_and_prepare_single_stock, binary_prediction_matrix, BINARY_PREDICTION_FIELDS
+from src.model_registry import get_policy
+from src.simulation import (
+    as_float_array, volume_array, simulate_xgboost_policy, simulate_lstm_policy, sweep_xgboost_policy,
+    simulate_xgboost_policy_path, simulate_lstm_policy_path, empty_path
+)
+from src.costs import cost_rates, execution_price
+
+# Parameter grid searched by find_best_strategy_params.
+STRATEGY_THRESHOLDS = list(range(0, 9))
+STRATEGY_PERCENTAGES = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+def buy_and_hold_path(df, initial_balance=10000, cost_model=None):
+    """Per-candle equity of buying at the first price and holding until the end."""
+    if df.empty:
+        return empty_path(0)
+
+    close = as_float_array(df, 'close')
+    fee_rate, half_spread, impact = cost_rates(cost_model)
+    buy_price = execution_price(close[0], initial_balance / close[0], volume_array(df)[0], 1.0, half_spread, impact) * (1.0 + fee_rate)
+
+    print(f"first timestamp: {df['timestamp'].iloc[0]}", flush=True)
+    print(f"last timestamp: {df['timestamp'].iloc[-1]}", flush=True)
 
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "..", "Model")
-MODEL_SAVE_PATH = os.path.join(MODEL_DIR, "best_model.zip")
+    shares_bought = initial_balance / buy_price
+    path = empty_path(len(close))
+    path['equity'][:] = shares_bought * close
+    path['position_value'][:] = path['equity']
+    path['traded'][0] = shares_bought * close[0]
+    path['costs'][0] = shares_bought * (buy_price - close[0])
+    return path
 
-def run_buy_and_hold_policy(df, initial_balance=10000):
+def run_buy_and_hold_policy(df, initial_balance=10000, cost_model=None):
     """Simulates buying at the first price and holding until the end."""
     if df.empty:
         return initial_balance
-    
-    start_price = df['close'].iloc[0]
-    end_price = df['close'].iloc[-1]
 
-    print(f"first timestamp: {df['timestamp'].iloc[0]}", flush=True)
-    print(f"last timestamp: {df['timestamp'].iloc[-1]}", flush=True)
+    return float(buy_and_hold_path(df, initial_balance, cost_model)['equity'][-1])
 
-    shares_bought = initial_balance / start_price
-    final_value = shares_bought * end_price
-    
-    return final_value
+def rl_policy_path(df, initial_balance=10000, cost_model=None, volume=None):
+    """
+    Simulates the trained RL agent over the historical data and records the
+    equity, position value, traded notional and costs at every row of `df`.
+    Rows before the first decision keep the initial balance, and rows after
+    the env stops early (the portfolio fell below half the initial balance)
+    keep its last equity and position value. `volume` is the candle volume
+    aligned with `df`, which has none among its features.
+    """
+    path = empty_path(len(df))
+    path['equity'][:] = initial_balance
+    path['position_value'][:] = 0.0
 
-def run_rl_policy(df, initial_balance=10000):
-    """Simulates the trained RL agent over the historical data."""
     if len(df) < 15: # Not enough data for even one observation
-        return initial_balance
+        return path
 
-    model = SAC.load(MODEL_SAVE_PATH)
+    model = get_policy()
+    close = as_float_array(df, 'close')
 
-    env = define_env(df, initial_balance)
+    env = define_env(df, initial_balance, cost_model=cost_model, volume=volume)
 
     obs, info = env.reset() 
     done = False
     
     while not done:
         action, _ = model.predict(obs, deterministic=True)
+        trade_step, shares_before = env.current_step, env.shares_held
         obs, reward, terminated, truncated, info = env.step(action)
         done = terminated or truncated
-        
-    return env.portfolio_value
 
-def run_xgBoost_policy(df, initial_balance=10000, threshold=5, percentage_to_act=0.1):
+        path['traded'][trade_step] = abs(env.shares_held - shares_before) * close[trade_step]
+        path['costs'][trade_step] = env.trade_cost
+        # Steps advance one row at a time, so every row after the first decision is written once
+        path['equity'][env.current_step] = env.portfolio_value
+        path['position_value'][env.current_step] = env.portfolio_value - env.balance
+
+    # A busted episode ends before the last row; the agent trades no more after it
+    last_step = env.current_step
+    path['equity'][last_step + 1:] = path['equity'][last_step]
+    path['position_value'][last_step + 1:] = path['position_value'][last_step]
+    return path
+
+def run_rl_policy(df, initial_balance=10000, cost_model=None, volume=None):
+    """Simulates the trained RL agent over the historical data."""
+    if len(df) < 15: # Not enough data for even one observation
+        return initial_balance
+
+    return float(rl_policy_path(df, initial_balance, cost_model, volume)['equity'][-1])
+
+def xgboost_policy_path(df, initial_balance=10000, threshold=5, percentage_to_act=0.1, cost_model=None):
+    """Per-candle equity, position value, traded notional and costs of the XGBoost policy."""
+    return simulate_xgboost_policy_path(
+        as_float_array(df, 'close'),
+        as_float_array(df, 'max_positive_threshold'),
+        initial_balance, threshold, percentage_to_act,
+        volume_array(df), cost_model
+    )
+
+def run_xgBoost_policy(df, initial_balance=10000, threshold=5, percentage_to_act=0.1, cost_model=None):
     """
     Simulates a simple policy based on your external XGboost classification predictions.
     Policy:
@@ -56,36 +111,26 @@ def run_xgBoost_policy(df, initial_balance=10000, threshold=5, percentage_to_act
     - Otherwise, hold.
     """
 
-    BIGGEST_THRESHOLD = 8
-
     if df.empty:
         return initial_balance
 
-    balance = initial_balance
-    shares_held = 0
-
-    for i, row in df.iterrows():
-        current_price = row['close']
-        prediction = row['max_positive_threshold']
-
-        if prediction >= threshold and balance > 0:
-            # Buy Signal
-            shares_to_buy = (percentage_to_act * balance) / current_price
-            shares_held += shares_to_buy
-            balance -= shares_to_buy * current_price
-        elif prediction <= (BIGGEST_THRESHOLD - threshold) and shares_held > 0:
-            # Sell Signal
-            shares_to_sell = percentage_to_act * shares_held
-            balance += shares_to_sell * current_price
-            shares_held -= shares_to_sell
-        # Else: Hold
-
-    # Final value is whatever cash is left plus the value of shares held at the end
-    final_value = balance + (shares_held * df['close'].iloc[-1])
-
-    return final_value
-
-def run_lstm_policy(df, initial_balance=10000, threshold=0.002):
+    return simulate_xgboost_policy(
+        as_float_array(df, 'close'),
+        as_float_array(df, 'max_positive_threshold'),
+        initial_balance, threshold, percentage_to_act,
+        volume_array(df), cost_model
+    )
+
+def lstm_policy_path(df, initial_balance=10000, threshold=0.002, cost_model=None):
+    """Per-candle equity, position value, traded notional and costs of the LSTM policy."""
+    return simulate_lstm_policy_path(
+        as_float_array(df, 'close'),
+        as_float_array(df, 'pct_prediction'),
+        initial_balance, threshold,
+        volume_array(df), cost_model
+    )
+
+def run_lstm_policy(df, initial_balance=10000, threshold=0.002, cost_model=None):
     """
     Simulates a simple policy based on your external LSTM regression predictions.
     Policy:
@@ -96,27 +141,12 @@ def run_lstm_policy(df, initial_balance=10000, threshold=0.002):
     if df.empty:
         return initial_balance
 
-    balance = initial_balance
-    shares_held = 0
-
-    for i, row in df.iterrows():
-        current_price = row['close']
-        prediction = row['pct_prediction']
-
-        if prediction > threshold and balance > 0:
-            # Buy Signal
-            shares_to_buy = balance / current_price
-            shares_held += shares_to_buy
-            balance = 0
-        elif prediction < -threshold and shares_held > 0:
-            # Sell Signal
-            balance += shares_held * current_price
-            shares_held = 0
-        # Else: Hold
-
-    # Final value is whatever cash is left plus the value of shares held at the end
-    final_value = balance + (shares_held * df['close'].iloc[-1])
-    return final_value
+    return simulate_lstm_policy(
+        as_float_array(df, 'close'),
+        as_float_array(df, 'pct_prediction'),
+        initial_balance, threshold,
+        volume_array(df), cost_model
+    )
 
 ############### Helper Functions #################### 
 
@@ -142,54 +172,60 @@ def analyze_model_edge(df):
     edge_analysis['avg_actual_return_bps'] = edge_analysis['actual_future_return'] * 10000 # In basis points
     
     print(edge_analysis[['max_positive_threshold', 'avg_actual_return_bps']].to_string(index=False))
+
+    # Per-threshold view straight from the binary matrix: average return when each threshold fires
+    binary_matrix = binary_prediction_matrix(df)
+    future_returns = df['actual_future_return'].to_numpy(dtype=np.float64)
+    positives = binary_matrix.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hit_returns = (binary_matrix.T.astype(np.float64) @ future_returns) / positives
+    threshold_analysis = pd.DataFrame({
+        'threshold': BINARY_PREDICTION_FIELDS,
+        'positive_rate': positives / max(len(df), 1),
+        'avg_actual_return_bps': hit_returns * 10000
+    })
+
+    print("\nAverage actual future return when each threshold predicts positive:\n")
+    print(threshold_analysis.to_string(index=False))
     print("\n" + "="*40)
 
-def find_best_strategy_params(df, initial_balance=10000):
+def sweep_strategy_params(df, initial_balance=10000, thresholds=STRATEGY_THRESHOLDS, percentages=STRATEGY_PERCENTAGES, cost_model=None):
     """
-    This function runs the optimization loop ONLY on the validation data.
+    Scores every threshold x percentage combination of the XGBoost policy in a
+    single pass over the data. Returns the full score surface together with the
+    best combination.
     """
+    final_values = sweep_xgboost_policy(
+        as_float_array(df, 'close'),
+        as_float_array(df, 'max_positive_threshold'),
+        thresholds, percentages, initial_balance,
+        volume_array(df), cost_model
+    )
+
     best_params = {'threshold': None, 'percentage': None}
-    max_final_value = 0
+    best_index = np.unravel_index(np.argmax(final_values), final_values.shape)
+    max_final_value = float(final_values[best_index])
+
+    # Same rule as the original loop: only accept a strictly positive value.
+    if max_final_value > 0:
+        best_params['threshold'] = thresholds[best_index[0]]
+        best_params['percentage'] = percentages[best_index[1]]
+
+    return {
+        "thresholds": list(thresholds),
+        "percentages": list(percentages),
+        "final_values": final_values,
+        "best_params": best_params,
+        "best_value": max_final_value
+    }
 
+def find_best_strategy_params(df, initial_balance=10000):
+    """
+    This function runs the optimization loop ONLY on the validation data.
+    """
     print("\n--- Optimizing Strategy on VALIDATION Data ---")
-    for threshold in range(0, 9):
-        for percentage in [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]:
-            # This is your simple policy function, we just pass params to it now
-            final_value = run_xgBoost_policy(
-                df, initial_balance, threshold, percentage
-            )
-            if final_value > max_final_value:
-                max_final_value = final_value
-                best_params['threshold'] = threshold
-                best_params['percentage'] = percentage
-
-    print(f"Optimal parameters found: {best_params} with value {max_final_value:,.2f}")
-    return best_params
-
-def save_best_strategy_params():
-    print(f">>> Trying To Create The File. <<<", flush=True)
-
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(BASE_DIR, 'strategy_config.json')
-
-    start_date = "2025-01-01 00:00:00"
-    end_date = "2025-06-29 09:20:00"
+    sweep = sweep_strategy_params(df, initial_balance)
+    best_params = sweep['best_params']
 
-    full_strategy_config = {}
-
-    for stock in stocks_to_train:
-        full_df = fetch_and_prepare_single_stock(start_date, end_date, stock)
-
-        best_xgboost_params = find_best_strategy_params(full_df)
-
-        full_strategy_config[stock] = {
-            "xgboost_policy": best_xgboost_params
-        }
-
-    with open(config_path, 'w') as f:
-        # json.dump() is the function that does the writing.
-        # indent=4 makes the file human-readable.
-        json.dump(full_strategy_config, f, indent=4) 
-    print("Successfully saved strategy configuration.")
-
-    return full_strategy_config
\ No newline at end of file
+    print(f"Optimal parameters found: {best_params} with value {sweep['best_value']:,.2f}")
+    return best_params
@@ -0,0 +1,210 @@
+import os
+import json
+import hashlib
+import sqlite3
+import redis
+from contextlib import closing
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from src.feature_cache import get_featured_stock_frame
+from src.simulation import as_float_array
+from src.backtest_engine import sweep_strategy_params
+from src.recommendation_cache import get_client
+from consts import AVAILABLE_STOCKS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CALIBRATION_STORE_PATH = os.environ.get('CALIBRATION_STORE_PATH', os.path.join(BASE_DIR, 'calibration_store.sqlite3'))
+LEGACY_CONFIG_PATH = os.path.join(BASE_DIR, 'strategy_config.json')
+
+# Default range the XGBoost policy parameters are fitted on.
+CALIBRATION_START_DATE = "2025-01-01 00:00:00"
+CALIBRATION_END_DATE = "2025-06-29 09:20:00"
+# How often beat re-runs the calibration, and how long a requested calibration
+# blocks further requests for the same stock.
+CALIBRATION_INTERVAL = float(os.environ.get('CALIBRATION_INTERVAL', 24 * 60 * 60)) # seconds
+CALIBRATION_REQUEST_TTL = int(os.environ.get('CALIBRATION_REQUEST_TTL', 60 * 60)) # seconds
+
+def _connect(store_path=CALIBRATION_STORE_PATH):
+    conn = sqlite3.connect(store_path, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS calibrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stock TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            params TEXT NOT NULL,
+            best_value REAL,
+            surface TEXT,
+            created_at TEXT NOT NULL,
+            UNIQUE (stock, start_date, end_date, fingerprint)
+        )
+    """)
+    return conn
+
+def data_fingerprint(df):
+    """Hashes the columns the calibration depends on, so new or changed data gets a new record."""
+    digest = hashlib.sha256()
+    digest.update(str(df['timestamp'].iloc[0]).encode())
+    digest.update(str(df['timestamp'].iloc[-1]).encode())
+    digest.update(as_float_array(df, 'close').tobytes())
+    digest.update(as_float_array(df, 'max_positive_threshold').tobytes())
+    return digest.hexdigest()[:16]
+
+def _calibrate_stock(stock, start_date, end_date):
+    """Fetches one stock and sweeps the XGBoost policy grid."""
+    df = get_featured_stock_frame(start_date, end_date, stock)
+    if df is None or df.empty:
+        return None
+
+    sweep = sweep_strategy_params(df)
+    print(f"Calibrated {stock}: {sweep['best_params']} with value {sweep['best_value']:,.2f}", flush=True)
+
+    return {
+        "stock": stock,
+        "start_date": start_date,
+        "end_date": end_date,
+        "fingerprint": data_fingerprint(df),
+        "params": {"xgboost_policy": sweep['best_params']},
+        "best_value": sweep['best_value'],
+        "surface": {
+            "thresholds": sweep['thresholds'],
+            "percentages": sweep['percentages'],
+            "final_values": sweep['final_values'].tolist()
+        }
+    }
+
+def save_calibration(record, store_path=CALIBRATION_STORE_PATH):
+    """
+    Stores a calibration result and returns its version number. Re-running on
+    the same stock, range and data is a no-op and returns the existing version.
+    """
+    with closing(_connect(store_path)) as conn, conn:
+        existing = conn.execute(
+            "SELECT version FROM calibrations WHERE stock = ? AND start_date = ? AND end_date = ? AND fingerprint = ?",
+            (record['stock'], record['start_date'], record['end_date'], record['fingerprint'])
+        ).fetchone()
+        if existing:
+            return existing[0]
+
+        (latest_version,) = conn.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM calibrations WHERE stock = ?", (record['stock'],)
+        ).fetchone()
+        version = latest_version + 1
+
+        conn.execute(
+            "INSERT INTO calibrations (stock, start_date, end_date, fingerprint, version, params, best_value, surface, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record['stock'], record['start_date'], record['end_date'], record['fingerprint'], version,
+                json.dumps(record['params']), record['best_value'], json.dumps(record['surface']),
+                datetime.now(timezone.utc).isoformat()
+            )
+        )
+    return version
+
+def load_latest_calibration(stock, store_path=CALIBRATION_STORE_PATH):
+    """Returns the params of the newest calibration for `stock`, or None."""
+    if not os.path.exists(store_path):
+        return None
+
+    with closing(_connect(store_path)) as conn:
+        row = conn.execute(
+            "SELECT params FROM calibrations WHERE stock = ? ORDER BY version DESC LIMIT 1", (stock,)
+        ).fetchone()
+    return json.loads(row[0]) if row else None
+
+def calibrate_stock(stock, start_date=CALIBRATION_START_DATE, end_date=CALIBRATION_END_DATE):
+    """
+    Calibrates one stock and writes the result to the calibration store.
+    Returns its params, or None without data. The service runs one
+    calibrate_stock_task per stock (see app.calibrate_strategies_task).
+    """
+    record = _calibrate_stock(stock, start_date, end_date)
+    if record is None:
+        print(f"Warning: No data found for {stock}. Skipping calibration.", flush=True)
+        return None
+
+    version = save_calibration(record)
+    print(f">>> Stored calibration v{version} for {stock}. <<<", flush=True)
+    return record['params']
+
+def run_calibration(stocks=AVAILABLE_STOCKS, start_date=CALIBRATION_START_DATE, end_date=CALIBRATION_END_DATE, max_workers=None):
+    """
+    Calibrates every stock in this process, for CLI/offline runs. Returns
+    {stock: params}. The stocks run on threads: the grid kernel releases the
+    GIL and each store write is its own SQLite transaction.
+    """
+    max_workers = max_workers or min(len(stocks), os.cpu_count() or 1)
+    print(f">>> Calibrating strategy params for {stocks} with {max_workers} workers. <<<", flush=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {stock: executor.submit(calibrate_stock, stock, start_date, end_date) for stock in stocks}
+        config = {stock: future.result() for stock, future in futures.items()}
+
+    return {stock: params for stock, params in config.items() if params is not None}
+
+def _request_key(stock):
+    return f"calibration:requested:{stock}"
+
+def request_calibration(stock):
+    """
+    Queues calibrate_stock_task for `stock` unless one was already
+    requested within CALIBRATION_REQUEST_TTL. Never raises: a failed request
+    only means the stock stays uncalibrated until the next beat run.
+    """
+    client = get_client()
+    try:
+        if client is not None and not client.set(_request_key(stock), 1, nx=True, ex=CALIBRATION_REQUEST_TTL):
+            return
+        # The Celery app registered by app.py; imported here so the module works without a broker
+        from celery import current_app
+        current_app.send_task('app.calibrate_stock_task', args=[stock])
+        print(f"!!! No calibration found for {stock}. Queued a calibration. !!!", flush=True)
+    except Exception as e:
+        print(f"Warning: Could not queue a calibration for {stock}: {e}", flush=True)
+
+def clear_calibration_requests(stocks):
+    """Lets stocks whose calibration just ran be requested again."""
+    client = get_client()
+    if client is None:
+        return
+    try:
+        client.delete(*[_request_key(stock) for stock in stocks])
+    except redis.RedisError as e:
+        print(f"Warning: Could not clear calibration requests: {e}", flush=True)
+
+def get_strategy_params(stock):
+    """
+    Resolves the strategy params for `stock`: the latest stored calibration
+    first, then the legacy strategy_config.json. On a miss it queues a
+    calibration in the background and returns None instead of blocking the
+    caller for the whole grid search.
+    """
+    params = load_latest_calibration(stock)
+    if params is not None:
+        return params
+
+    if os.path.exists(LEGACY_CONFIG_PATH):
+        with open(LEGACY_CONFIG_PATH, 'r') as f:
+            legacy_config = json.load(f)
+        if stock in legacy_config:
+            return legacy_config[stock]
+
+    request_calibration(stock)
+    return None
+
+def save_best_strategy_params():
+    """Runs a full calibration and also writes it to the legacy strategy_config.json."""
+    full_strategy_config = run_calibration()
+
+    with open(LEGACY_CONFIG_PATH, 'w') as f:
+        json.dump(full_strategy_config, f, indent=4)
+    print("Successfully saved strategy configuration.")
+
+    return full_strategy_config
+
+if __name__ == "__main__":
+    run_calibration()
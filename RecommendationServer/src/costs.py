@@ -0,0 +1,65 @@
+import math
+from numba import vectorize
+
+# All rates are in basis points of the traded notional. `slippage_bps` is the
+# extra price impact of an order that takes the candle's whole volume; smaller
+# orders pay it pro rata.
+COST_MODELS = {
+    'none': {'fee_bps': 0.0, 'spread_bps': 0.0, 'slippage_bps': 0.0},
+    'maker': {'fee_bps': 2.0, 'spread_bps': 0.0, 'slippage_bps': 0.0},
+    'taker': {'fee_bps': 10.0, 'spread_bps': 2.0, 'slippage_bps': 100.0},
+}
+DEFAULT_COST_MODEL = 'none'
+
+def resolve_cost_model(spec=None):
+    """
+    Resolves the `cost_model` of a backtest request: None (the default), the
+    name of a preset in COST_MODELS, or a dict with any of fee_bps,
+    spread_bps and slippage_bps (missing rates are 0).
+    """
+    if spec is None:
+        spec = DEFAULT_COST_MODEL
+
+    if isinstance(spec, str):
+        if spec not in COST_MODELS:
+            raise ValueError(f"Unknown cost model '{spec}'. Available: {list(COST_MODELS)}")
+        return dict(COST_MODELS[spec])
+
+    if isinstance(spec, dict):
+        unknown = set(spec) - set(COST_MODELS['none'])
+        if unknown:
+            raise ValueError(f"Unknown cost model rates: {sorted(unknown)}")
+
+        cost_model = dict(COST_MODELS['none'])
+        for rate, value in spec.items():
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Cost model rate '{rate}' must be a number.")
+            if not math.isfinite(value) or value < 0:
+                raise ValueError(f"Cost model rate '{rate}' must be a non-negative number.")
+            cost_model[rate] = value
+        return cost_model
+
+    raise ValueError("cost_model must be a preset name or a dict of rates.")
+
+def cost_rates(spec=None):
+    """(fee_rate, half_spread, impact) as fractions, the form the simulations take."""
+    cost_model = resolve_cost_model(spec)
+    return cost_model['fee_bps'] / 1e4, cost_model['spread_bps'] / 2e4, cost_model['slippage_bps'] / 1e4
+
+@vectorize(['float64(float64, float64, float64, float64, float64, float64)'], cache=True)
+def execution_price(price, shares, volume, side, half_spread, impact):
+    """
+    Price paid (side=1) or received (side=-1) for `shares` on a candle: the
+    close moved by half the spread plus slippage proportional to the share of
+    the candle's `volume` the order takes (capped at all of it). Works on
+    scalars, arrays and inside the compiled simulation kernels.
+    """
+    if shares <= 0:
+        participation = 0.0
+    elif volume > 0:
+        participation = min(shares / volume, 1.0)
+    else:
+        participation = 1.0
+    return price * (1.0 + side * (half_spread + impact * participation))
@@ -0,0 +1,31 @@
+import os
+import threading
+from pymongo import MongoClient
+
+MONGO_URI =  os.environ.get('CONNECTION_STRING', 'mongodb://localhost:27017/') #'mongodb://host.docker.internal:27017/' #
+MONGO_DATABASE_NAME = os.environ.get('DATABASE_NAME', 'crypto_predictions') #'crypto_predictions' #
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 20))
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+def get_mongo_client():
+    """
+    Returns the MongoClient shared by everything in this process, creating it
+    on first use. A MongoClient must not be used across fork(), so a forked
+    process (Celery prefork child, calibration pool worker) lazily builds its
+    own client instead of reusing the parent's connection pool.
+    """
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, connect=False)
+                _client_pid = pid
+    return _client
+
+def get_database():
+    return get_mongo_client()[MONGO_DATABASE_NAME]
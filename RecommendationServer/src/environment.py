@@ -4,9 +4,12 @@ import os
 import matplotlib.pyplot as plt
 from stable_baselines3 import SAC
 from stable_baselines3.common.callbacks import EvalCallback, StopTrainingOnNoModelImprovement
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecMonitor
 
-from src.model import StockTradingEnv
-from src.get_data import prepare_and_combine_data
+from src.model import FastStockTradingEnv, BatchedStockTradingEnv
+from src.get_data import prepare_and_combine_data, prepare_stock_frames
+from consts import AVAILABLE_STOCKS, WINDOW_SIZE
 
 # --- Configuration ---
 TOTAL_TIMESTEPS = 1000 # 50 * 23909
@@ -14,6 +17,8 @@ EVAL_FREQ = 500 # 23909
 OUTPUT_DIR = "/app/output" 
 MODEL_SAVE_PATH = "Model/best_model"
 TENSORBOARD_LOG_DIR = "./sac_stock_tensorboard/"
+N_ENVS = os.cpu_count() or 1 # Size of the vectorized training pool
+MIN_SHARD_SIZE = 50 * WINDOW_SIZE # Shortest chronological shard worth an env of its own
 
 
 # Ensure output directory exists
@@ -21,8 +26,8 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # --- Training Script ---
 def train_model(train_df, val_df):
-    env = StockTradingEnv(train_df)
-    eval_env = StockTradingEnv(val_df)
+    env = FastStockTradingEnv(train_df)
+    eval_env = FastStockTradingEnv(val_df)
 
     # This callback will stop training if the eval reward does not improve for `max_no_improvement_evals`
     stop_train_callback = StopTrainingOnNoModelImprovement(
@@ -48,9 +53,105 @@ def train_model(train_df, val_df):
     model.learn(total_timesteps=TOTAL_TIMESTEPS, callback=eval_callback)
     return model, env
 
+# --- Vectorized Training ---
+def shard_frames(frames, n_shards):
+    """
+    Splits each frame into contiguous chronological shards so that the total
+    number of shards is close to `n_shards`. Shards never cross the boundary
+    between two stocks.
+    """
+    shards_per_frame = max(n_shards // max(len(frames), 1), 1)
+    shards = []
+    for df in frames:
+        n = max(min(shards_per_frame, len(df) // MIN_SHARD_SIZE), 1)
+        bounds = np.linspace(0, len(df), n + 1).astype(int)
+        shards.extend(df.iloc[start:end].reset_index(drop=True) for start, end in zip(bounds[:-1], bounds[1:]))
+    return shards
+
+def _make_env_fn(df):
+    def _init():
+        return Monitor(FastStockTradingEnv(df))
+    return _init
+
+def build_vec_env(frames):
+    """One env per frame, stepped in subprocesses when the machine has more than one core."""
+    env_fns = [_make_env_fn(df) for df in frames]
+    if len(env_fns) > 1 and N_ENVS > 1:
+        return SubprocVecEnv(env_fns)
+    return DummyVecEnv(env_fns)
+
+def train_model_vectorized(train_frames, val_frames, n_envs=N_ENVS):
+    """
+    Trains SAC on a pool of environments, one per stock or chronological
+    shard, and evaluates on a parallel validation env with one env per stock.
+    """
+    env = build_vec_env(shard_frames(train_frames, n_envs))
+    eval_env = build_vec_env(val_frames)
+    print(f"Training on {env.num_envs} envs, evaluating on {eval_env.num_envs} envs.")
+
+    stop_train_callback = StopTrainingOnNoModelImprovement(
+        max_no_improvement_evals=10,
+        min_evals=10,
+        verbose=1
+    )
+
+    eval_callback = EvalCallback(eval_env,
+                             best_model_save_path=OUTPUT_DIR,
+                             eval_freq=max(EVAL_FREQ // env.num_envs, 1), # eval_freq counts vectorized steps
+                             n_eval_episodes=eval_env.num_envs,
+                             deterministic=True,
+                             callback_on_new_best=stop_train_callback,
+                             render=False)
+
+    model = SAC(
+        policy="MlpPolicy", 
+        env=env, 
+        verbose=1,
+        tensorboard_log=TENSORBOARD_LOG_DIR
+    )
+
+    try:
+        model.learn(total_timesteps=TOTAL_TIMESTEPS, callback=eval_callback)
+    finally:
+        env.close()
+        eval_env.close()
+
+    return model, env
+
+def train_model_batched(train_df, val_df, num_envs=128):
+    """
+    Trains SAC on a BatchedStockTradingEnv: `num_envs` episodes with random
+    start points, all stepped as one array operation in this process.
+    """
+    env = VecMonitor(BatchedStockTradingEnv(train_df, num_envs=num_envs, random_start=True))
+    eval_env = Monitor(FastStockTradingEnv(val_df))
+
+    stop_train_callback = StopTrainingOnNoModelImprovement(
+        max_no_improvement_evals=10,
+        min_evals=10,
+        verbose=1
+    )
+
+    eval_callback = EvalCallback(eval_env,
+                             best_model_save_path=OUTPUT_DIR,
+                             eval_freq=max(EVAL_FREQ // num_envs, 1), # eval_freq counts vectorized steps
+                             deterministic=True,
+                             callback_on_new_best=stop_train_callback,
+                             render=False)
+
+    model = SAC(
+        policy="MlpPolicy", 
+        env=env, 
+        verbose=1,
+        tensorboard_log=TENSORBOARD_LOG_DIR
+    )
+    
+    model.learn(total_timesteps=TOTAL_TIMESTEPS, callback=eval_callback)
+    return model, env
+
 # --- Test Model ---
 def test_model(test_df, model):
-    test_env = StockTradingEnv(test_df)
+    test_env = FastStockTradingEnv(test_df)
 
     # --- Random Policy (Corrected for Continuous Space) ----
     print("--- Running Random Policy for Comparison ---")
@@ -138,18 +239,22 @@ def plot_stock_and_actions(env, df):
     plt.savefig(os.path.join(OUTPUT_DIR, "actions_vs_price.png"))
     plt.clf()
 
-def define_env(data, initial_balance=10000, initial_shares_held=0):
-    env = StockTradingEnv(df=data, initial_shares_held=initial_shares_held, initial_balance=initial_balance)
+def define_env(data, initial_balance=10000, initial_shares_held=0, cost_model=None, volume=None):
+    env = FastStockTradingEnv(df=data, initial_shares_held=initial_shares_held, initial_balance=initial_balance,
+                              cost_model=cost_model, volume=volume)
 
     return env
 
 # --- Run Training ---
 #if __name__ == "__main__":
-def main():
-    stocks_to_train = ["BTC", "ETH", "LTC"]
+def main(vectorized=True):
+    stocks_to_train = AVAILABLE_STOCKS
     start_date = "2025-01-01 00:00:00"
     end_date = "2025-07-19 07:15:00"
 
+    if vectorized:
+        return main_vectorized(stocks_to_train, start_date, end_date)
+
     full_df = prepare_and_combine_data(stocks_to_train, start_date, end_date)
     
     print("--- Verifying Cleanliness of Input DataFrame ---")
@@ -182,3 +287,22 @@ def main():
     #model = SAC.load(MODEL_SAVE_PATH)
 
     #test_model(test_df, model)
+
+def main_vectorized(stocks_to_train, start_date, end_date):
+    frames = prepare_stock_frames(stocks_to_train, start_date, end_date)
+
+    # Split every stock chronologically on its own, so no episode crosses two stocks
+    # 70% for train, 15% for validation, 15% for test
+    train_frames, val_frames = [], []
+    for stock, df in frames.items():
+        train_size = int(len(df) * 0.7)
+        val_size = int(len(df) * 0.15)
+        train_frames.append(df[:train_size].reset_index(drop=True))
+        val_frames.append(df[train_size : train_size + val_size].reset_index(drop=True))
+        print(f"{stock}: Train size: {train_size}, Val size: {val_size}, Test size: {len(df) - train_size - val_size}")
+
+    model, env = train_model_vectorized(train_frames, val_frames)
+
+    print(env.observation_space.shape)
+
+    return model
@@ -0,0 +1,214 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import inspect
+from importlib import metadata
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from src import get_data
+from src.get_data import fetch_and_prepare_single_stock, get_latest_timestamp_from_mongo, count_predictions_by_day
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FEATURE_CACHE_DIR = os.environ.get('FEATURE_CACHE_DIR', os.path.join(BASE_DIR, 'feature_cache'))
+
+# Extra history fetched in front of every computed range so the rolling/EWM
+# indicators are warmed up; (29/30)^1000 makes the cut-off effect negligible.
+FEATURE_WARMUP_ROWS = 1000
+CANDLE_INTERVAL = pd.Timedelta(minutes=5)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _feature_code_hash():
+    """Hash of everything that shapes a cached row; any change starts a fresh cache."""
+    digest = hashlib.sha256()
+    for func in (get_data.binary_prediction_matrix, get_data.get_max_positive_threshold, get_data.calculate_indicators, get_data.fetch_synced_candles, get_data.add_features, get_data.fetch_and_prepare_single_stock):
+        digest.update(inspect.getsource(func).encode())
+    try:
+        digest.update(metadata.version('ta').encode())
+    except metadata.PackageNotFoundError:
+        pass
+    digest.update(str(FEATURE_WARMUP_ROWS).encode())
+    return digest.hexdigest()[:12]
+
+FEATURE_CODE_HASH = _feature_code_hash()
+
+def _stock_dir(stock, cache_dir):
+    return os.path.join(cache_dir, stock, FEATURE_CODE_HASH)
+
+def _day_path(stock_dir, day):
+    return os.path.join(stock_dir, f"day={day}.arrow")
+
+def _shift(timestamp, delta):
+    return (pd.to_datetime(timestamp) + delta).strftime(TIMESTAMP_FORMAT)
+
+@contextmanager
+def _stock_lock(stock, cache_dir):
+    """Exclusive per-stock lock, shared by every worker process using the same cache dir."""
+    os.makedirs(os.path.join(cache_dir, stock), exist_ok=True)
+    with open(os.path.join(cache_dir, stock, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path) # Readers holding the old file keep a valid mapping
+
+def _read_meta(stock_dir):
+    path = os.path.join(stock_dir, 'meta.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _write_meta(stock_dir, meta):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+    _atomic_write(os.path.join(stock_dir, 'meta.json'), write)
+
+def _read_day(path):
+    """Memory-maps one uncompressed Arrow IPC day file."""
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+def _write_rows(stock_dir, df):
+    """Merges featured rows into their day partitions, rewriting only the touched days. Returns those days."""
+    days = []
+    for day, day_df in df.groupby(df['timestamp'].str.slice(0, 10), sort=False):
+        path = _day_path(stock_dir, day)
+        if os.path.exists(path):
+            day_df = pd.concat([_read_day(path).to_pandas(), day_df], ignore_index=True)
+            day_df = day_df.drop_duplicates(subset='timestamp', keep='last')
+        day_df = day_df.sort_values('timestamp').reset_index(drop=True)
+        _atomic_write(path, lambda tmp_path: feather.write_feather(day_df, tmp_path, compression='uncompressed'))
+        days.append(day)
+    return days
+
+def _compute_rows(stock, start_date, end_date):
+    """Features [start_date, end_date] from Mongo, with warm-up history fetched in front and cut off again."""
+    warmup_start = _shift(start_date, -FEATURE_WARMUP_ROWS * CANDLE_INTERVAL)
+    df = fetch_and_prepare_single_stock(warmup_start, end_date, stock=stock)
+    if df is None or df.empty:
+        return None
+    return df[(df['timestamp'] >= start_date) & (df['timestamp'] <= end_date)]
+
+def _remove_stale_versions(stock, cache_dir):
+    """Drops cache directories written by older indicator code."""
+    root = os.path.join(cache_dir, stock)
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name != FEATURE_CODE_HASH and os.path.isdir(path):
+            print(f"FEATURE CACHE: Removing stale cache {path}", flush=True)
+            shutil.rmtree(path, ignore_errors=True)
+
+def _day_runs(days):
+    """Groups sorted 'YYYY-MM-DD' days into (first, last) runs of consecutive days."""
+    runs = []
+    for day in days:
+        if runs and pd.to_datetime(day) - pd.to_datetime(runs[-1][1]) == pd.Timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+def _refeature_backfilled_days(stock, stock_dir, meta, counts, written_days):
+    """
+    Re-features the cached days whose binary/pct prediction counts changed since
+    they were featured, e.g. after the ModelServer fixing/missing-preds scripts
+    backfilled them, so their rows stop carrying the -1/0 placeholders. Days
+    cached before the counts were recorded are re-featured once.
+    """
+    stored = meta.setdefault('prediction_counts', {})
+    stale = sorted(
+        day for day in counts
+        if day not in written_days and stored.get(day) != counts[day] and os.path.exists(_day_path(stock_dir, day))
+    )
+    for first, last in _day_runs(stale):
+        start, end = max(f"{first} 00:00:00", meta['start']), min(f"{last} 23:59:59", meta['end'])
+        print(f"FEATURE CACHE: Predictions for {stock} changed between {first} and {last}. Re-featuring.", flush=True)
+        df = _compute_rows(stock, start, end)
+        if df is not None and not df.empty:
+            _write_rows(stock_dir, df)
+
+    # Counts taken before featuring: a backfill landing meanwhile is caught next time
+    for day in set(stale) | set(written_days):
+        stored[day] = counts.get(day, [0, 0])
+
+def refresh_feature_cache(stock, start_date, end_date, cache_dir=FEATURE_CACHE_DIR):
+    """
+    Makes sure the cache covers [start_date, end_date]. Only the missing part in
+    front of the cached span and the timestamps newer than it are fetched and
+    featured. Cached rows are recomputed only for the days whose prediction
+    counts in Mongo changed since they were featured.
+    """
+    stock_dir = _stock_dir(stock, cache_dir)
+
+    with _stock_lock(stock, cache_dir):
+        _remove_stale_versions(stock, cache_dir)
+        os.makedirs(stock_dir, exist_ok=True)
+        meta = _read_meta(stock_dir)
+        counts = count_predictions_by_day(f"{start_date[:10]} 00:00:00", f"{end_date[:10]} 23:59:59", stock)
+        written_days = []
+
+        if meta is None:
+            df = _compute_rows(stock, start_date, end_date)
+            if df is None or df.empty:
+                return
+            written_days += _write_rows(stock_dir, df)
+            meta = {"start": start_date, "end": df['timestamp'].iloc[-1]}
+
+        if start_date < meta['start']:
+            df = _compute_rows(stock, start_date, meta['start'])
+            if df is not None:
+                written_days += _write_rows(stock_dir, df[df['timestamp'] < meta['start']])
+            meta['start'] = start_date
+
+        if end_date > meta['end']:
+            latest = get_latest_timestamp_from_mongo(stock)
+            if latest and latest > meta['end']:
+                df = _compute_rows(stock, meta['end'], min(end_date, latest))
+                if df is not None:
+                    df = df[df['timestamp'] > meta['end']]
+                    if not df.empty:
+                        written_days += _write_rows(stock_dir, df)
+                        meta['end'] = df['timestamp'].iloc[-1]
+
+        _refeature_backfilled_days(stock, stock_dir, meta, counts, written_days)
+        _write_meta(stock_dir, meta)
+
+def read_feature_cache(stock, start_date, end_date, cache_dir=FEATURE_CACHE_DIR):
+    """Reads [start_date, end_date] from the memory-mapped day partitions, or None if nothing is cached."""
+    stock_dir = _stock_dir(stock, cache_dir)
+    days = pd.date_range(pd.to_datetime(start_date).normalize(), pd.to_datetime(end_date).normalize(), freq='D')
+    paths = [_day_path(stock_dir, day.strftime('%Y-%m-%d')) for day in days]
+    tables = [_read_day(path) for path in paths if os.path.exists(path)]
+    if not tables:
+        return None
+
+    table = pa.concat_tables(tables, promote_options='default')
+    timestamps = table['timestamp']
+    mask = pc.and_(pc.greater_equal(timestamps, start_date), pc.less_equal(timestamps, end_date))
+    return table.filter(mask).to_pandas()
+
+def get_featured_stock_frame(start_date, end_date, stock="BTC", cache_dir=FEATURE_CACHE_DIR):
+    """
+    Cached drop-in for fetch_and_prepare_single_stock: refreshes the on-disk
+    feature cache for the range and returns it from there.
+    """
+    refresh_feature_cache(stock, start_date, end_date, cache_dir)
+    df = read_feature_cache(stock, start_date, end_date, cache_dir)
+    if df is None or df.empty:
+        return None
+
+    print(f"FEATURE CACHE: {len(df)} rows for {stock} between {start_date} and {end_date}.", flush=True)
+    return df
@@ -1,6 +1,8 @@
 import os
-from pymongo import MongoClient
+import multiprocessing
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from ta.momentum import RSIIndicator, StochasticOscillator
 from ta.trend import MACD, ADXIndicator
 from ta.volatility import BollingerBands, AverageTrueRange
@@ -8,29 +10,39 @@ from ta.volume import OnBalanceVolumeIndicator, ChaikinMoneyFlowIndicator
 import numpy as np
 import pandas as pd
 
-from consts import final_feature_columns, WINDOW_SIZE
+from src.db import get_database
+from consts import final_feature_columns
 
-MONGO_URI =  os.environ.get('CONNECTION_STRING', 'mongodb://localhost:27017/') #'mongodb://host.docker.internal:27017/' #
-MONGO_DATABASE_NAME = os.environ.get('DATABASE_NAME', 'crypto_predictions') #'crypto_predictions' # 
+BINARY_PREDICTION_FIELDS = [f'prediction_threshold_{i}' for i in range(9)]
+FETCH_BATCH_SIZE = 10000
+# The feature pool is started while fetch threads are running, so avoid a plain fork.
+_FEATURE_POOL_CONTEXT = multiprocessing.get_context('forkserver')
 
 # --- Helper Functions ---
 
-def get_max_positive_threshold(preds_dict):
+def binary_prediction_matrix(df):
     """
-    Finds the highest numerical threshold index that has a positive prediction (value of 1).
-    Returns -1.0 if no thresholds are positive. This is the robust version.
+    Returns the binary predictions of `df` as an (N, 9) int8 matrix where
+    column i is 1 when `prediction_threshold_i` was positive. Missing columns
+    and rows without a prediction count as 0.
     """
-    if not isinstance(preds_dict, dict):
-        return -1.0 # Handle case where data might be missing (e.g., NaN)
-        
-    positive_threshold_indices = [
-        int(k.split('_')[-1]) for k, v in preds_dict.items() if v == 1
-    ]
-    
-    if not positive_threshold_indices:
-        return -1.0
-    else:
-        return float(max(positive_threshold_indices))
+    matrix = np.zeros((len(df), len(BINARY_PREDICTION_FIELDS)), dtype=np.int8)
+    for i, field in enumerate(BINARY_PREDICTION_FIELDS):
+        if field in df.columns:
+            matrix[:, i] = pd.to_numeric(df[field], errors='coerce').to_numpy(dtype=np.float64) == 1
+    return matrix
+
+def get_max_positive_threshold(binary_matrix):
+    """
+    Finds, per row, the highest threshold index that has a positive prediction.
+    Returns -1.0 for rows where no threshold is positive.
+    """
+    if binary_matrix.shape[0] == 0:
+        return np.empty(0, dtype=np.float64)
+
+    # argmax over the reversed columns finds the highest positive index
+    highest = binary_matrix.shape[1] - 1 - np.argmax(binary_matrix[:, ::-1], axis=1)
+    return np.where(binary_matrix.any(axis=1), highest, -1).astype(np.float64)
 
 def calculate_indicators(df_normalized):
     """
@@ -72,75 +84,88 @@ def calculate_indicators(df_normalized):
     
     return df[indicator_cols]
 
+def _build_sync_pipeline(start_date, end_date, stock):
+    """
+    Aggregation run on `ohlc_{stock}` that joins the binary and pct predictions
+    by timestamp and cuts the range at the latest timestamp available in all
+    three collections, so everything happens in one server round trip. A
+    prediction kind with no documents in the range does not cut it: those rows
+    are kept without predictions.
+    """
+    always = {"documents": ["unbounded", "unbounded"]}
+
+    return [
+        {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
+        {"$project": {"_id": 0}},
+        {"$lookup": {
+            "from": f"binary_{stock}",
+            "localField": "timestamp",
+            "foreignField": "timestamp",
+            "pipeline": [{"$project": {"_id": 0, **{field: 1 for field in BINARY_PREDICTION_FIELDS}}}],
+            "as": "binary"
+        }},
+        {"$lookup": {
+            "from": f"pct_{stock}",
+            "localField": "timestamp",
+            "foreignField": "timestamp",
+            "pipeline": [{"$project": {"_id": 0, "prediction": 1}}],
+            "as": "pct"
+        }},
+        {"$set": {
+            **{field: {"$last": f"$binary.{field}"} for field in BINARY_PREDICTION_FIELDS},
+            "pct_prediction": {"$last": "$pct.prediction"}
+        }},
+        # Latest timestamp that has binary / pct data, computed over the whole result
+        {"$setWindowFields": {
+            "sortBy": {"timestamp": 1},
+            "output": {
+                "latest_binary_ts": {"$max": {"$cond": [{"$gt": [{"$size": "$binary"}, 0]}, "$timestamp", None]}, "window": always},
+                "latest_pct_ts": {"$max": {"$cond": [{"$gt": [{"$size": "$pct"}, 0]}, "$timestamp", None]}, "window": always}
+            }
+        }},
+        {"$match": {"$expr": {"$and": [
+            {"$lte": ["$timestamp", {"$ifNull": ["$latest_binary_ts", end_date]}]},
+            {"$lte": ["$timestamp", {"$ifNull": ["$latest_pct_ts", end_date]}]}
+        ]}}},
+        {"$unset": ["binary", "pct", "latest_binary_ts", "latest_pct_ts"]},
+        {"$sort": {"timestamp": 1}}
+    ]
+
 def _fetch_and_sync_raw_data(start_date, end_date, stock, db):
     """
-    (Internal Helper) Efficiently fetches and synchronizes raw data from MongoDB.
-    1. Finds the latest common timestamp *first*.
-    2. Fetches only the necessary data up to that timestamp.
+    (Internal Helper) Fetches and synchronizes raw data from MongoDB in a single
+    aggregation: OHLC rows joined with the binary and pct predictions, cut at
+    the latest timestamp common to all three collections. The cursor is
+    streamed straight into per-column lists. The match and both joins rely on
+    the timestamp indexes mongo-init creates; this path only reads.
     """
     print(f"Fetching data for {stock} from {start_date} to {end_date}...")
 
-    # Efficiently get the max timestamp from each collection using the DB index
-    collections = {
-        'ohlc': db[f"ohlc_{stock}"],
-        'binary': db[f"binary_{stock}"],
-        'pct': db[f"pct_{stock}"]
-    }
-    
-    timestamps = []
-    for name, coll in collections.items():
-        # find_one with sort is highly efficient
-        latest_doc = coll.find_one(
-            {"timestamp": {"$lte": end_date}}, 
-            sort=[("timestamp", -1)], 
-            projection={"timestamp": 1}
-        )
-        if latest_doc:
-            timestamps.append(latest_doc['timestamp'])
-
-    print(f"Latest timestamps for {stock}: {timestamps}")
-
-    if not timestamps: return None
-    
-    # Determine the latest timestamp where ALL data is available
-    latest_common_ts = min(timestamps)
-
-    # Fetch all data ONCE, up to the synchronized timestamp
-    query = {"timestamp": {"$gte": start_date, "$lte": latest_common_ts}}
-    ohlc_data = list(collections['ohlc'].find(query))
-    binary_data = list(collections['binary'].find(query))
-    pct_data = list(collections['pct'].find(query))
-    
-    # Merge the data
-    # Initialize the map with the core OHLC data. This is our source of truth.
-    data_map = {doc["timestamp"]: doc for doc in ohlc_data}
-
-    # Update with binary data ONLY for timestamps that already exist.
-    for doc in binary_data:
-        ts = doc.get("timestamp")
-        if ts in data_map:  # Check if the key exists before updating
-            data_map[ts]['binary_predictions'] = {}
-            for i in range(9): # Or whatever your number of thresholds is
-                key = f'prediction_threshold_{i}'
-                if key in doc:
-                    data_map[ts]['binary_predictions'][key] = doc[key]
-
-    # Update with pct data ONLY for timestamps that already exist.
-    for doc in pct_data:
-        ts = doc.get("timestamp")
-        if ts in data_map:  # Check if the key exists before updating
-            data_map[ts]['pct_prediction'] = doc["prediction"]
-
-    if not data_map: return None
-    
-    df = pd.DataFrame(list(data_map.values())).sort_values(by="timestamp")
-    return df
+    cursor = db[f"ohlc_{stock}"].aggregate(
+        _build_sync_pipeline(start_date, end_date, stock),
+        batchSize=FETCH_BATCH_SIZE,
+        allowDiskUse=True
+    )
+
+    columns = {}
+    num_rows = 0
+    for doc in cursor:
+        for key, value in doc.items():
+            if key not in columns:
+                columns[key] = [None] * num_rows # Backfill a field first seen mid-stream
+            columns[key].append(value)
+        num_rows += 1
+        for column in columns.values():
+            if len(column) < num_rows:
+                column.append(None) # Field missing from this document
+
+    if num_rows == 0: return None
+
+    return pd.DataFrame(columns)
 
 def get_latest_timestamp_from_mongo(stock):
     try:
-        # Connect to MongoDB
-        client = MongoClient(MONGO_URI)
-        db = client[MONGO_DATABASE_NAME]
+        db = get_database()
 
         # Collection names
         ohlc_collection_name = f"ohlc_{stock}"
@@ -178,138 +203,171 @@ def get_latest_timestamp_from_mongo(stock):
         print(f"An error occurred while fetching the latest timestamp for {stock}: {e}")    
         return None
 
+def count_predictions_by_day(start_date, end_date, stock):
+    """
+    {day: [binary documents, pct documents]} per 'YYYY-MM-DD' day between
+    `start_date` and `end_date`, so callers can spot predictions written (or
+    backfilled) after they last read a day. Days without any are left out.
+    """
+    db = get_database()
+    counts = {}
+    for i, kind in enumerate(("binary", "pct")):
+        cursor = db[f"{kind}_{stock}"].aggregate([
+            {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
+            {"$group": {"_id": {"$substrCP": ["$timestamp", 0, 10]}, "count": {"$sum": 1}}}
+        ])
+        for doc in cursor:
+            counts.setdefault(doc["_id"], [0, 0])[i] = doc["count"]
+    return counts
+
 # --- Main Data Functions ---
 
-def fetch_and_prepare_single_stock(start_date, end_date, stock = "BTC"):
+def fetch_synced_candles(start_date, end_date, stock = "BTC"):
     """
-    Fetches raw OHLC, binary predictions, and percentage predictions for a single stock
-    from MongoDB. It synchronizes them by timestamp and merges them into a single,
-    clean DataFrame.
-
-    This function DOES NOT calculate technical indicators. Its only job is to
-    get the raw, aligned data from the source.
+    Fetches the raw, timestamp-synced OHLC rows for a single stock with the
+    binary predictions as int8 `prediction_threshold_i` columns plus their
+    `max_positive_threshold`, and `pct_prediction` filled in. No technical
+    indicators are calculated here.
     """
-    try:
-        client = MongoClient(MONGO_URI)
-        db = client[MONGO_DATABASE_NAME]
+    db = get_database()
 
-        # Get raw, synced data using the efficient helper function
-        df = _fetch_and_sync_raw_data(start_date, end_date, stock, db)
+    # Get raw, synced data using the efficient helper function
+    df = _fetch_and_sync_raw_data(start_date, end_date, stock, db)
 
-        print(f"Fetched {len(df)} rows for {stock} from MongoDB between {start_date} and {end_date}.")
+    if df is None or df.empty:
+        return None
 
-        if df is None or df.empty:
-            return None
-        
-        print(df.columns, flush=True)
+    print(f"Fetched {len(df)} rows for {stock} from MongoDB between {start_date} and {end_date}.")
+    
+    print(df.columns, flush=True)
 
-        # If binary predictions were found, process them. Otherwise, create a default column.
-        if 'binary_predictions' in df.columns:
-            # Handle rows where a binary prediction might be missing (NaN)
-            df['binary_predictions'] = df['binary_predictions'].fillna({})
-            df["max_positive_threshold"] = df["binary_predictions"].apply(get_max_positive_threshold)
-        else:
-            df["max_positive_threshold"] = -1.0 # Default value if no binary data exists
+    # Keep the binary predictions as int8 columns and reduce them to the highest positive threshold.
+    # Rows (or stocks) without binary data get -1.0.
+    binary_matrix = binary_prediction_matrix(df)
+    for i, field in enumerate(BINARY_PREDICTION_FIELDS):
+        df[field] = binary_matrix[:, i]
+    df["max_positive_threshold"] = get_max_positive_threshold(binary_matrix)
 
-        # If percentage predictions were found, keep them. Otherwise, create a default column.
-        if 'pct_prediction' not in df.columns:
-            df['pct_prediction'] = 0.0 # Default value if no pct data exists
+    # If percentage predictions were found, keep them. Otherwise, create a default column.
+    if 'pct_prediction' not in df.columns:
+        df['pct_prediction'] = 0.0 # Default value if no pct data exists
 
-        final_df = df.copy()
+    return df
 
-        # Create the normalized df for stable indicator calculation
-        indicator_df = final_df[['open', 'high', 'low', 'close', 'volume']].pct_change()
-        indicator_df.dropna(inplace=True)
-        calculated_indicators = calculate_indicators(indicator_df)
+def add_features(df):
+    """
+    (CPU-bound) Adds the technical indicators and the lagged returns to a
+    frame returned by fetch_synced_candles.
+    """
+    final_df = df.copy()
 
-        # Join the stable indicators back to the main df
-        final_df = final_df.join(calculated_indicators)
+    # Create the normalized df for stable indicator calculation
+    indicator_df = final_df[['open', 'high', 'low', 'close', 'volume']].pct_change()
+    indicator_df.dropna(inplace=True)
+    calculated_indicators = calculate_indicators(indicator_df)
 
-        # Calculate lagged returns on the ORIGINAL price data
-        for lag in [1, 3, 5, 10]:
-            final_df[f'ret_lag_{lag}'] = final_df['close'].pct_change(lag)
+    # Join the stable indicators back to the main df
+    final_df = final_df.join(calculated_indicators)
 
-        if '_id' in final_df.columns: final_df.drop(columns=['_id'], inplace=True)
-        if 'binary_predictions' in final_df.columns: final_df.drop(columns=['binary_predictions'], inplace=True)
+    # Calculate lagged returns on the ORIGINAL price data
+    for lag in [1, 3, 5, 10]:
+        final_df[f'ret_lag_{lag}'] = final_df['close'].pct_change(lag)
 
-        print(f"Final df size : {len(final_df)} And has columns : {final_df.columns}")
+    if '_id' in final_df.columns: final_df.drop(columns=['_id'], inplace=True)
 
-        return final_df
+    print(f"Final df size : {len(final_df)} And has columns : {final_df.columns}")
+
+    return final_df
+
+def fetch_and_prepare_single_stock(start_date, end_date, stock = "BTC"):
+    """
+    Fetches raw OHLC, binary predictions, and percentage predictions for a single stock
+    from MongoDB, synchronized by timestamp, and adds the technical indicators
+    and lagged returns the models are trained on.
+    """
+    try:
+        df = fetch_synced_candles(start_date, end_date, stock)
+
+        if df is None or df.empty:
+            return None
+
+        return add_features(df)
 
     except Exception as e:
         print(f"An unexpected error occurred in fetch_and_prepare_single_stock for {stock}: {e}")
         # In a real system, you would log this error in more detail
         raise
 
+def _feature_matrix(df):
+    """(Process pool worker) Features one stock and returns its cleaned `final_feature_columns` matrix."""
+    featured_df = add_features(df)
+    return featured_df.reindex(columns=final_feature_columns).dropna().to_numpy(dtype=np.float64)
 
-def prepare_and_combine_data(stocks, start_date, end_date):
-    all_dfs = []
+@contextmanager
+def _stock_feature_jobs(stocks, start_date, end_date):
+    """
+    Fetches every stock on a thread pool and hands each frame to a process pool
+    as soon as it lands, so the Mongo I/O of one stock overlaps the indicator
+    math of another. Yields [(stock, raw_rows, future)] in `stocks` order,
+    where each future resolves to the stock's cleaned feature matrix.
+    """
     print(f"Preparing data for stocks: {stocks}")
+    num_workers = max(1, len(stocks))
 
-    for stock in stocks:
-        print(f"--- Processing {stock} ---")
-        featured_df  = fetch_and_prepare_single_stock(start_date, end_date, stock=stock)
-        
-        if featured_df  is None or featured_df .empty:
-            print(f"Warning: No data found for {stock}. Skipping.")
-            continue
+    with ThreadPoolExecutor(max_workers=num_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=min(num_workers, os.cpu_count() or 1), mp_context=_FEATURE_POOL_CONTEXT) as cpu_pool:
+        fetches = {io_pool.submit(fetch_synced_candles, start_date, end_date, stock): stock for stock in stocks}
 
-        all_dfs.append(featured_df)
+        jobs = {}
+        for fetch in as_completed(fetches):
+            stock = fetches[fetch]
+            df = fetch.result()
+            if df is None or df.empty:
+                print(f"Warning: No data found for {stock}. Skipping.")
+                continue
 
-    if not all_dfs:
-        print("Error: No data could be processed.")
-        return pd.DataFrame()
+            print(f"--- Processing {stock} ---")
+            jobs[stock] = (len(df), cpu_pool.submit(_feature_matrix, df))
+        fetches.clear()
+        fetch = df = None # Raw frames now live only in the workers
 
-    combined_df = pd.concat(all_dfs, ignore_index=True)
-    
-    # Keep only the columns we need, dropping the rest
-    # `reindex` is a safe way to select columns and handle missing ones
-    combined_df = combined_df.reindex(columns=final_feature_columns)
-    
-    # Final cleanup before returning
-    combined_df.dropna(inplace=True)
-    combined_df.reset_index(drop=True, inplace=True)
-    
-    print("\nData preparation complete.")
-    print(f"Total rows in final dataset: {len(combined_df)}")
-    print(f"Features being used ({len(combined_df.columns)}): {combined_df.columns.tolist()}")
+        yield [(stock, *jobs.pop(stock)) for stock in stocks if stock in jobs]
 
-    return combined_df
-
-def get_data_for_recommendation(stock):
-    end_time_str = get_latest_timestamp_from_mongo(stock)
-    if not end_time_str:
-        print(f"No data found for {stock}.")
-        return None
-    
-    print(f"Latest timestamp for {stock}: {end_time_str}")
-
-    # We need at least 30 for indicators, plus 10 for env, plus buffer.
-    lookback_periods = 200 
-    start_time = pd.to_datetime(end_time_str) - pd.Timedelta(minutes=5 * lookback_periods) 
-
-    start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S')
-
-    featured_df  = fetch_and_prepare_single_stock(start_time_str, end_time_str, stock=stock)
-    if featured_df  is None or featured_df.empty:
-        print(f"No data found for {stock} in the specified date range.")
-        return None
-    
-    # Apply the same final filtering
-    final_df = featured_df.reindex(columns=final_feature_columns)
-    final_df.dropna(inplace=True)
+def prepare_stock_frames(stocks, start_date, end_date):
+    """
+    Fetches and features each stock separately and returns {stock: frame},
+    with every frame reduced to `final_feature_columns` and cleaned. Used when
+    each stock should get its own environment instead of one concatenated frame.
+    """
+    frames = {}
 
-    print(f"Final df size : {len(final_df)} And has columns : {final_df.columns}")
+    with _stock_feature_jobs(stocks, start_date, end_date) as jobs:
+        for stock, _, future in jobs:
+            frames[stock] = pd.DataFrame(future.result(), columns=final_feature_columns)
 
-    if final_df.empty:
-        print(f"Dataframe is empty after feature engineering and cleaning for {stock}.")
-        return None
+    return frames
 
-    required_rows = WINDOW_SIZE + 5
+def prepare_and_combine_data(stocks, start_date, end_date):
+    with _stock_feature_jobs(stocks, start_date, end_date) as jobs:
+        if not jobs:
+            print("Error: No data could be processed.")
+            return pd.DataFrame()
+
+        # Featuring only drops rows, so the raw row counts bound the combined size.
+        # Each stock is copied in (in order) and released, instead of pd.concat holding every frame twice.
+        combined = np.empty((sum(raw_rows for _, raw_rows, _ in jobs), len(final_feature_columns)))
+        num_rows = 0
+        while jobs:
+            stock, _, future = jobs.pop(0)
+            matrix = future.result()
+            combined[num_rows:num_rows + len(matrix)] = matrix
+            num_rows += len(matrix)
+            del future, matrix
+
+    combined_df = pd.DataFrame(combined[:num_rows], columns=final_feature_columns, copy=False)
     
-    if len(final_df) < required_rows:
-        print(f"CRITICAL ERROR: Not enough data remains. Required: {required_rows}, Found: {len(final_df)}")
-        return None
+    print("\nData preparation complete.")
+    print(f"Total rows in final dataset: {len(combined_df)}")
+    print(f"Features being used ({len(combined_df.columns)}): {combined_df.columns.tolist()}")
 
-    # Return only the last `WINDOW_SIZE` rows needed by the environment, with a little buffer
-    return final_df.tail(required_rows)
\ No newline at end of file
+    return combined_df
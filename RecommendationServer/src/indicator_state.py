@@ -0,0 +1,350 @@
+import os
+import math
+import fcntl
+import pickle
+import hashlib
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from src.get_data import fetch_synced_candles, get_latest_timestamp_from_mongo
+from consts import final_feature_columns, WINDOW_SIZE
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDICATOR_STATE_DIR = os.environ.get('INDICATOR_STATE_DIR', os.path.join(BASE_DIR, 'indicator_state'))
+
+# Candles replayed to build a fresh state; long enough for every EWM/Wilder
+# smoothing to forget its starting point.
+BOOTSTRAP_PERIODS = 1000
+CANDLE_INTERVAL = pd.Timedelta(minutes=5)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Featured rows kept for the environment window (WINDOW_SIZE + 5 after dropna).
+RECOMMENDATION_BUFFER_ROWS = 4 * (WINDOW_SIZE + 5)
+RET_LAGS = [1, 3, 5, 10]
+
+# Persisted states are only reused by the code that wrote them.
+with open(__file__, 'rb') as _source:
+    STATE_CODE_HASH = hashlib.sha256(_source.read()).hexdigest()[:12]
+
+def _div(a, b):
+    """a / b with the float semantics pandas uses (x/0 -> +-inf, 0/0 -> NaN)."""
+    if b == 0:
+        return math.nan if a == 0 or math.isnan(a) else math.copysign(math.inf, a)
+    return a / b
+
+# --- One-candle-at-a-time versions of the `ta` indicators in calculate_indicators ---
+
+class _Ewm:
+    """Series.ewm(alpha=alpha, adjust=False, min_periods=min_periods).mean(); leading NaNs are skipped."""
+    def __init__(self, alpha, min_periods):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.value = math.nan
+        self.count = 0
+
+    def update(self, x):
+        if not math.isnan(x):
+            self.value = x if self.count == 0 else (1 - self.alpha) * self.value + self.alpha * x
+            self.count += 1
+        return self.value if self.count >= self.min_periods else math.nan
+
+class _Rsi:
+    def __init__(self, window):
+        self.up = _Ewm(1 / window, window)
+        self.down = _Ewm(1 / window, window)
+        self.prev_close = None
+
+    def update(self, close):
+        diff = math.nan if self.prev_close is None else close - self.prev_close
+        self.prev_close = close
+
+        emaup = self.up.update(diff if diff > 0 else 0.0)
+        emadn = self.down.update(-diff if diff < 0 else 0.0)
+        if emadn == 0:
+            return 100.0
+        return 100 - (100 / (1 + emaup / emadn))
+
+class _Stoch:
+    def __init__(self, window):
+        self.lows = deque(maxlen=window)
+        self.highs = deque(maxlen=window)
+
+    def update(self, high, low, close):
+        self.lows.append(low)
+        self.highs.append(high)
+        if len(self.lows) < self.lows.maxlen:
+            return math.nan
+        smin, smax = min(self.lows), max(self.highs)
+        return _div(100 * (close - smin), smax - smin)
+
+class _MacdDiff:
+    def __init__(self, window_fast=12, window_slow=26, window_sign=9):
+        self.fast = _Ewm(2 / (window_fast + 1), window_fast)
+        self.slow = _Ewm(2 / (window_slow + 1), window_slow)
+        self.signal = _Ewm(2 / (window_sign + 1), window_sign)
+
+    def update(self, close):
+        macd = self.fast.update(close) - self.slow.update(close)
+        return macd - self.signal.update(macd)
+
+class _Adx:
+    """
+    Mirrors ADXIndicator: TR/+DM/-DM are summed over candles 1..window, then
+    Wilder-smoothed; ADX is the mean of the first `window` DX values, then
+    Wilder-smoothed. Warm-up rows are 0, as in `ta`.
+    """
+    def __init__(self, window=14):
+        self.window = window
+        self.row = 0
+        self.prev = None
+        self.trs = self.dip = self.din = 0.0
+        self.first_dx = []
+        self.adx = 0.0
+
+    def update(self, high, low, close):
+        w = self.window
+        row, self.row = self.row, self.row + 1
+        prev, self.prev = self.prev, (high, low, close)
+        if prev is None:
+            return 0.0
+
+        prev_high, prev_low, prev_close = prev
+        tr = max(high, prev_close) - min(low, prev_close)
+        diff_up = high - prev_high
+        diff_down = prev_low - low
+        pos = diff_up if diff_up > diff_down and diff_up > 0 else 0.0
+        neg = diff_down if diff_down > diff_up and diff_down > 0 else 0.0
+
+        if row <= w:
+            self.trs += tr
+            self.dip += pos
+            self.din += neg
+            if row < w:
+                return 0.0
+        else:
+            self.trs = self.trs - (self.trs / float(w)) + tr
+            self.dip = self.dip - (self.dip / float(w)) + pos
+            self.din = self.din - (self.din / float(w)) + neg
+
+        dip = 100 * (self.dip / self.trs) if self.trs != 0 else 0
+        din = 100 * (self.din / self.trs) if self.trs != 0 else 0
+        dx = 100 * abs((dip - din) / (dip + din)) if dip + din != 0 else 0
+
+        smoothed = row - w
+        if smoothed < w:
+            self.first_dx.append(dx)
+            if smoothed < w - 1:
+                return 0.0
+            self.adx = float(np.mean(self.first_dx))
+        else:
+            self.adx = ((self.adx * (w - 1)) + dx) / float(w)
+        return self.adx
+
+class _BollingerWidth:
+    def __init__(self, window, window_dev=2):
+        self.closes = deque(maxlen=window)
+        self.window_dev = window_dev
+
+    def update(self, close):
+        self.closes.append(close)
+        if len(self.closes) < self.closes.maxlen:
+            return math.nan
+        mavg = float(np.mean(self.closes))
+        mstd = float(np.std(self.closes))
+        hband = mavg + self.window_dev * mstd
+        lband = mavg - self.window_dev * mstd
+        return _div(hband - lband, close + 1e-9)
+
+class _Atr:
+    def __init__(self, window):
+        self.window = window
+        self.row = 0
+        self.prev_close = None
+        self.first_tr = []
+        self.atr = 0.0
+
+    def update(self, high, low, close):
+        w = self.window
+        if self.prev_close is None:
+            tr = high - low
+        else:
+            tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        row, self.row = self.row, self.row + 1
+
+        if row < w:
+            self.first_tr.append(tr)
+            if row < w - 1:
+                return 0.0
+            self.atr = float(np.mean(self.first_tr))
+        else:
+            self.atr = (self.atr * (w - 1) + tr) / float(w)
+        return self.atr
+
+class _Cmf:
+    def __init__(self, window=20):
+        self.money_flow = deque(maxlen=window)
+        self.volumes = deque(maxlen=window)
+
+    def update(self, high, low, close, volume):
+        mfv = _div((close - low) - (high - close), high - low)
+        if math.isnan(mfv):
+            mfv = 0.0
+        self.money_flow.append(mfv * volume)
+        self.volumes.append(volume)
+        if len(self.volumes) < self.volumes.maxlen:
+            return math.nan
+        return _div(sum(self.money_flow), sum(self.volumes))
+
+class IndicatorState:
+    """
+    Per-stock streaming equivalent of fetch_and_prepare_single_stock: every
+    `update` advances all indicators by one candle and appends the candle's
+    featured row to a short buffer.
+    """
+    def __init__(self):
+        self.code_hash = STATE_CODE_HASH
+        self.last_timestamp = None
+        self.prev_ohlcv = None
+        self.closes = deque(maxlen=max(RET_LAGS) + 1)
+        self.rows = deque(maxlen=RECOMMENDATION_BUFFER_ROWS)
+
+        self.rsi = {window: _Rsi(window) for window in [5, 14, 30]}
+        self.stoch = {window: _Stoch(window) for window in [5, 14, 30]}
+        self.macd = _MacdDiff()
+        self.adx = _Adx(14)
+        self.bb = {window: _BollingerWidth(window) for window in [14, 30]}
+        self.atr = {window: _Atr(window) for window in [14, 30]}
+        self.cmf = _Cmf(20)
+
+    def _indicators(self, open_, high, low, close, volume):
+        features = {}
+        for window in [5, 14, 30]:
+            features[f'RSI_{window}'] = self.rsi[window].update(close)
+            features[f'Stoch_k_{window}'] = self.stoch[window].update(high, low, close)
+        features['MACD_diff'] = self.macd.update(close)
+        features['ADX'] = self.adx.update(high, low, close)
+        for window in [14, 30]:
+            features[f'BB_width_{window}'] = self.bb[window].update(close)
+            features[f'ATR_norm_{window}'] = self.atr[window].update(high, low, close)
+        features['CMF'] = self.cmf.update(high, low, close, volume)
+        return features
+
+    def update(self, candle):
+        ohlcv = tuple(float(candle[column]) for column in ['open', 'high', 'low', 'close', 'volume'])
+        row = {
+            'timestamp': candle['timestamp'],
+            'close': ohlcv[3],
+            'max_positive_threshold': candle['max_positive_threshold'],
+            'pct_prediction': candle['pct_prediction']
+        }
+
+        # Indicators run on candle-to-candle percentage changes, like calculate_indicators
+        if self.prev_ohlcv is not None:
+            normalized = [_div(value, prev) - 1 for value, prev in zip(ohlcv, self.prev_ohlcv)]
+            if not any(math.isnan(value) for value in normalized):
+                row.update(self._indicators(*normalized))
+        self.prev_ohlcv = ohlcv
+
+        self.closes.append(ohlcv[3])
+        for lag in RET_LAGS:
+            row[f'ret_lag_{lag}'] = _div(self.closes[-1], self.closes[-1 - lag]) - 1 if len(self.closes) > lag else math.nan
+
+        self.rows.append(row)
+        self.last_timestamp = candle['timestamp']
+        return row
+
+    def feed(self, df):
+        """Advances the state over every candle in `df` newer than the last one seen."""
+        if self.last_timestamp is not None:
+            df = df[df['timestamp'] > self.last_timestamp]
+        for candle in df.to_dict('records'):
+            self.update(candle)
+
+    def frame(self):
+        return pd.DataFrame(list(self.rows)).reindex(columns=final_feature_columns)
+
+# --- Persistence ---
+
+def _state_path(stock, state_dir):
+    return os.path.join(state_dir, f"{stock}.pkl")
+
+def load_indicator_state(stock, state_dir=INDICATOR_STATE_DIR):
+    path = _state_path(stock, state_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load indicator state for {stock}: {e}", flush=True)
+        return None
+    return state if getattr(state, 'code_hash', None) == STATE_CODE_HASH else None
+
+def save_indicator_state(stock, state, state_dir=INDICATOR_STATE_DIR):
+    path = _state_path(stock, state_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(tmp_path, path)
+
+def _shift(timestamp, delta):
+    return (pd.to_datetime(timestamp) + delta).strftime(TIMESTAMP_FORMAT)
+
+def advance_indicator_state(stock, state_dir=INDICATOR_STATE_DIR):
+    """
+    Brings the persisted state of `stock` up to the latest synced timestamp,
+    fetching only the candles it has not seen yet. A missing, outdated or
+    too-far-behind state is rebuilt by replaying the last BOOTSTRAP_PERIODS candles.
+    """
+    latest = get_latest_timestamp_from_mongo(stock)
+    if not latest:
+        return None
+
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, f"{stock}.lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX) # One task advances a stock at a time
+        try:
+            state = load_indicator_state(stock, state_dir)
+            if state is not None and state.last_timestamp >= latest:
+                return state
+
+            bootstrap_start = _shift(latest, -BOOTSTRAP_PERIODS * CANDLE_INTERVAL)
+            if state is None or state.last_timestamp < bootstrap_start:
+                print(f"INDICATOR STATE: Bootstrapping {stock} from {bootstrap_start}", flush=True)
+                state = IndicatorState()
+                candles = fetch_synced_candles(bootstrap_start, latest, stock)
+            else:
+                candles = fetch_synced_candles(state.last_timestamp, latest, stock)
+
+            if candles is not None:
+                state.feed(candles)
+            save_indicator_state(stock, state, state_dir)
+            return state
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def get_data_for_recommendation(stock):
+    """
+    Returns the last WINDOW_SIZE + 5 featured rows for `stock`, read from its
+    incremental indicator state instead of re-featuring a window of history.
+    """
+    state = advance_indicator_state(stock)
+    if state is None or not state.rows:
+        print(f"No data found for {stock}.")
+        return None
+
+    print(f"Latest timestamp for {stock}: {state.last_timestamp}")
+
+    final_df = state.frame()
+    final_df.dropna(inplace=True)
+
+    required_rows = WINDOW_SIZE + 5
+
+    if len(final_df) < required_rows:
+        print(f"CRITICAL ERROR: Not enough data remains. Required: {required_rows}, Found: {len(final_df)}")
+        return None
+
+    return final_df.tail(required_rows)
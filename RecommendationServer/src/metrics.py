@@ -0,0 +1,94 @@
+import numpy as np
+
+# Candles are 5 minutes and crypto trades around the clock.
+PERIODS_PER_YEAR = 365 * 24 * 12
+# Points per equity curve shipped to the frontend.
+EQUITY_CURVE_POINTS = 500
+
+def period_returns(curve):
+    """Simple returns between consecutive equity values (0 where the previous equity is not positive)."""
+    previous = curve[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(previous > 0, curve[1:] / previous - 1, 0.0)
+
+def max_drawdown(curve):
+    """Largest peak-to-trough loss as a negative fraction of the peak."""
+    if len(curve) == 0:
+        return 0.0
+    running_max = np.maximum.accumulate(curve)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = np.where(running_max > 0, curve / running_max - 1, 0.0)
+    return float(drawdown.min())
+
+def sharpe_ratio(returns, periods_per_year=PERIODS_PER_YEAR):
+    if len(returns) < 2:
+        return 0.0
+    std = returns.std(ddof=1)
+    return float(returns.mean() / std * np.sqrt(periods_per_year)) if std > 0 else 0.0
+
+def sortino_ratio(returns, periods_per_year=PERIODS_PER_YEAR):
+    if len(returns) < 2:
+        return 0.0
+    downside = np.sqrt(np.mean(np.minimum(returns, 0.0) ** 2))
+    return float(returns.mean() / downside * np.sqrt(periods_per_year)) if downside > 0 else 0.0
+
+def compute_metrics(path, initial_balance, periods_per_year=PERIODS_PER_YEAR):
+    """
+    Summary statistics of one simulated policy from its per-candle `equity`,
+    `position_value` and `traded` arrays. Every statistic is a single O(N)
+    array reduction.
+
+    - turnover: notional traded divided by the average equity
+    - winRate: share of candles entered with a position that ended positive
+    - exposure: average fraction of equity held in the asset
+    - costsPaid: fees, spread and slippage paid versus trading at the close
+    """
+    equity = path['equity']
+    curve = np.concatenate(([float(initial_balance)], equity))
+    returns = period_returns(curve)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exposure = np.where(equity > 0, path['position_value'] / equity, 0.0)
+
+    # A candle's return is earned by the position held when it opened
+    held_going_in = np.concatenate(([0.0], exposure[:-1])) > 0
+    in_market_returns = returns[held_going_in]
+
+    return {
+        "totalReturn": float(curve[-1] / curve[0] - 1) if curve[0] > 0 else 0.0,
+        "maxDrawdown": max_drawdown(curve),
+        "sharpe": sharpe_ratio(returns, periods_per_year),
+        "sortino": sortino_ratio(returns, periods_per_year),
+        "turnover": float(path['traded'].sum() / curve.mean()) if curve.mean() > 0 else 0.0,
+        "numTrades": int(np.count_nonzero(path['traded'])),
+        "winRate": float((in_market_returns > 0).mean()) if len(in_market_returns) else 0.0,
+        "exposure": float(exposure.mean()) if len(exposure) else 0.0,
+        "costsPaid": float(path['costs'].sum())
+    }
+
+def downsample_curve(timestamps, equity, max_points=EQUITY_CURVE_POINTS):
+    """
+    Evenly spaced [timestamp, equity] points for charting. The first, last,
+    highest and lowest points are always kept so the drawdown stays visible.
+    """
+    num_points = len(equity)
+    if num_points == 0:
+        return []
+
+    if num_points <= max_points:
+        indices = np.arange(num_points)
+    else:
+        indices = np.linspace(0, num_points - 1, max_points).round().astype(np.int64)
+        indices = np.unique(np.concatenate((indices, [np.argmin(equity), np.argmax(equity)])))
+
+    return [[str(timestamps[i]), float(equity[i])] for i in indices]
+
+def summarize_policy(path, initial_balance, timestamps):
+    """The per-policy block of a backtest result: final value, profit, metrics and a downsampled equity curve."""
+    final_value = float(path['equity'][-1]) if len(path['equity']) else float(initial_balance)
+    return {
+        "finalValue": final_value,
+        "profit": final_value - initial_balance,
+        "metrics": compute_metrics(path, initial_balance),
+        "equityCurve": downsample_curve(timestamps, path['equity'])
+    }
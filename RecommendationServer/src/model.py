@@ -1,9 +1,63 @@
+import math
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from stable_baselines3.common.vec_env import VecEnv
 
 from consts import WINDOW_SIZE
+from src.costs import cost_rates, execution_price
+
+def normalize_windows(data, window_size):
+    """
+    Builds every observation window of `data` (rows x features) at once.
+    Row k of the result is the flattened window data[k : k + window_size],
+    z-scored per feature exactly like StockTradingEnv._market_observation.
+    """
+    # (num_windows, features, window_size) view over the original array, no copy
+    windows = sliding_window_view(data, window_size, axis=0)
+    mean = windows.mean(axis=-1, keepdims=True)
+    std = windows.std(axis=-1, ddof=1, keepdims=True)
+    normalized = (windows - mean) / (std + 1e-6)
+
+    # Back to (num_windows, window_size, features) so the flattening matches frame.values.flatten()
+    return np.ascontiguousarray(normalized.transpose(0, 2, 1).reshape(len(normalized), -1), dtype=np.float32)
+
+class RollingStd:
+    """
+    Fixed-size ring buffer over the last `size` values that keeps their mean
+    and population std (same as np.std) up to date in O(1) per push, using
+    Welford's update for a sliding window.
+    """
+
+    def __init__(self, size, fill=0.0):
+        self.size = size
+        self.reset(fill)
+
+    def reset(self, fill=0.0):
+        self.buffer = [fill] * self.size
+        self.position = 0
+        self.mean = fill
+        self.m2 = 0.0
+
+    def push(self, value):
+        old_value = self.buffer[self.position]
+        self.buffer[self.position] = value
+        self.position = (self.position + 1) % self.size
+
+        old_mean = self.mean
+        self.mean += (value - old_value) / self.size
+        self.m2 += (value - old_value) * (value - self.mean + old_value - old_mean)
+        if self.m2 < 0:  # Guard against tiny negative values from rounding
+            self.m2 = 0.0
+
+    def std(self):
+        return math.sqrt(self.m2 / self.size)
+
+    def values(self):
+        """The buffered values from oldest to newest."""
+        return self.buffer[self.position:] + self.buffer[:self.position]
 
 class StockTradingEnv(gym.Env):
     """
@@ -12,10 +66,14 @@ class StockTradingEnv(gym.Env):
 
     This version uses the paper's hybrid reward function, combining Profit/Loss
     with the Sharpe Ratio to encourage risk-adjusted returns.
+
+    Trades are filled at the prices of `cost_model` (see src.costs); `volume`
+    is the per-row candle volume its slippage term is scaled by.
     """
     metadata = {'render_modes': ['human']}
 
-    def __init__(self, df, window_size=WINDOW_SIZE, initial_shares_held=0, initial_balance=10000, risk_free_rate=0.0):
+    def __init__(self, df, window_size=WINDOW_SIZE, initial_shares_held=0, initial_balance=10000, risk_free_rate=0.0, reward_window=None,
+                 cost_model=None, volume=None):
         super(StockTradingEnv, self).__init__()
 
         # --- Data and Parameters ---
@@ -27,6 +85,10 @@ class StockTradingEnv(gym.Env):
         self.initial_balance = initial_balance
         self.initial_shares_held = initial_shares_held
         self.risk_free_rate = risk_free_rate # For Sharpe Ratio calculation
+        self.reward_window = reward_window or window_size # Number of returns in the Sharpe term
+        self.fee_rate, self.half_spread, self.impact = cost_rates(cost_model)
+        self.volume = np.full(len(self.df), np.inf) if volume is None else np.asarray(volume, dtype=np.float64)
+        self.trade_cost = 0.0 # Costs paid by the last step, relative to trading at the close
 
         # --- Action & Observation Spaces ---
         self.action_space = spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
@@ -39,7 +101,11 @@ class StockTradingEnv(gym.Env):
         # Initialize history lists for plotting and reward calculation
         self.actions_history = []
         self.reward_history = []
-        self.portfolio_returns_history = []
+        self.returns_window = RollingStd(self.reward_window)
+
+    @property
+    def portfolio_returns_history(self):
+        return self.returns_window.values()
 
     def reset(self, *, seed=None, options=None, mode='train'):
         super().reset(seed=seed)
@@ -54,14 +120,14 @@ class StockTradingEnv(gym.Env):
             # For training/backtesting, start at the beginning
             self.current_step = self.window_size
 
-        current_price = self.df.iloc[self.current_step - 1]['close']
+        current_price = self._price_at(self.current_step - 1)
         self.portfolio_value = self.initial_balance + self.initial_shares_held * current_price
 
         # Reset history lists for each new episode
         self.actions_history = []
         self.reward_history = []
-        # Initialize with zeros to have a full list from the start for std dev calculation
-        self.portfolio_returns_history = [0] * self.window_size 
+        # Start with a window full of zeros to have a full window from the start for std dev calculation
+        self.returns_window.reset()
 
         observation = self._next_observation()
         info = {'initial_portfolio_value': self.initial_balance}
@@ -74,13 +140,11 @@ class StockTradingEnv(gym.Env):
             # Return a zero vector that matches the observation space shape
             return np.zeros(self.observation_space.shape, dtype=np.float32)
     
-        frame = self.df.iloc[self.current_step - self.window_size : self.current_step]
-        normalized_frame = (frame - frame.mean()) / (frame.std() + 1e-6)
-        obs = normalized_frame.values.flatten()
+        obs = self._market_observation()
         
         normalized_balance = self.balance / self.portfolio_value if self.portfolio_value > 0 else 0
 
-        last_price_in_window = self.df.iloc[self.current_step - 1]['close']
+        last_price_in_window = self._price_at(self.current_step - 1)
         shares_ratio = (self.shares_held * last_price_in_window) / self.portfolio_value if self.portfolio_value > 0 else 0
         
         obs = np.append(obs, [normalized_balance, shares_ratio])
@@ -93,6 +157,15 @@ class StockTradingEnv(gym.Env):
 
         return obs.astype(np.float32)
 
+    def _market_observation(self):
+        """The normalized price/feature window ending right before current_step."""
+        frame = self.df.iloc[self.current_step - self.window_size : self.current_step]
+        normalized_frame = (frame - frame.mean()) / (frame.std() + 1e-6)
+        return normalized_frame.values.flatten()
+
+    def _price_at(self, step):
+        return self.df.iloc[step]['close']
+
     def step(self, action):
         if self.current_step >= len(self.df) - 1:
             last_obs = self._next_observation()
@@ -100,27 +173,33 @@ class StockTradingEnv(gym.Env):
         
         trade_amount_percent = action[0]
         prev_portfolio_value = self.portfolio_value
-        current_price = self.df.iloc[self.current_step]['close']
+        current_price = self._price_at(self.current_step)
         
         # Execute trade
+        volume = self.volume[self.current_step]
+        self.trade_cost = 0.0
         if trade_amount_percent > 0:
             amount_to_spend = self.balance * trade_amount_percent
-            shares_to_buy = amount_to_spend / current_price
+            buy_price = execution_price(current_price, amount_to_spend / current_price, volume, 1.0, self.half_spread, self.impact) * (1.0 + self.fee_rate)
+            shares_to_buy = amount_to_spend / buy_price
             self.balance -= amount_to_spend
             self.shares_held += shares_to_buy
+            self.trade_cost = shares_to_buy * (buy_price - current_price)
         elif trade_amount_percent < 0:
             proportion_to_sell = abs(trade_amount_percent)
             shares_to_sell = self.shares_held * proportion_to_sell
-            amount_received = shares_to_sell * current_price
+            sell_price = execution_price(current_price, shares_to_sell, volume, -1.0, self.half_spread, self.impact) * (1.0 - self.fee_rate)
+            amount_received = shares_to_sell * sell_price
             self.balance += amount_received
             self.shares_held -= shares_to_sell
+            self.trade_cost = shares_to_sell * (current_price - sell_price)
 
         self.actions_history.append((self.current_step, trade_amount_percent, current_price))
             
         self.current_step += 1
         done = self.current_step >= len(self.df) - 1
 
-        next_price = self.df.iloc[self.current_step]['close'] if not done else current_price
+        next_price = self._price_at(self.current_step) if not done else current_price
         self.portfolio_value = self.balance + (self.shares_held * next_price)
         
         # --- Calculate Hybrid Reward (PnL + Sharpe Ratio) ---
@@ -129,12 +208,8 @@ class StockTradingEnv(gym.Env):
         
         # 2. Risk-adjusted (Sharpe Ratio) component
         portfolio_return = (self.portfolio_value / prev_portfolio_value) - 1 if prev_portfolio_value > 0 else 0
-        self.portfolio_returns_history.append(portfolio_return)
-        
-        if len(self.portfolio_returns_history) > self.window_size:
-            self.portfolio_returns_history.pop(0)
-
-        returns_std = np.std(self.portfolio_returns_history)
+        self.returns_window.push(portfolio_return)
+        returns_std = self.returns_window.std()
         
         sharpe_ratio = 0
         if returns_std > 1e-6:
@@ -162,4 +237,199 @@ class StockTradingEnv(gym.Env):
             f"Price: {self.df.iloc[render_step]['close']:8.2f} | "
             f"Portfolio: {self.portfolio_value:10.2f} | "
             f"Profit: {profit:10.2f} ({profit_percent:5.2f}%)"
-        )
\ No newline at end of file
+        )
+
+class FastStockTradingEnv(StockTradingEnv):
+    """
+    Same environment as StockTradingEnv, but the frame is converted to a NumPy
+    array once and all normalized observation windows are precomputed, so
+    reset/step never touch pandas. Observations are served as slices of the
+    precomputed matrix.
+    """
+
+    def __init__(self, df, window_size=WINDOW_SIZE, initial_shares_held=0, initial_balance=10000, risk_free_rate=0.0, reward_window=None,
+                 cost_model=None, volume=None):
+        super(FastStockTradingEnv, self).__init__(df, window_size, initial_shares_held, initial_balance, risk_free_rate, reward_window,
+                                                  cost_model, volume)
+
+        self.data = self.df.to_numpy()
+        self.prices = np.ascontiguousarray(self.data[:, self.df.columns.get_loc('close')])
+        self.normalized_windows = normalize_windows(self.data, self.window_size)
+
+    def _market_observation(self):
+        return self.normalized_windows[self.current_step - self.window_size]
+
+    def _price_at(self, step):
+        return self.prices[step]
+
+class BatchedStockTradingEnv(VecEnv):
+    """
+    N independent StockTradingEnv episodes over the same frame, stored as
+    length-N arrays (balances, shares, step indices, reward windows) and
+    advanced together with one NumPy operation per quantity per step.
+    Implements the SB3 VecEnv interface, so SAC can consume it directly.
+
+    With `random_start=True` every episode starts at a random step instead of
+    `window_size`, which decorrelates the batch. `cost_model` and `volume`
+    price the trades as in StockTradingEnv.
+    """
+
+    def __init__(self, df, num_envs=64, window_size=WINDOW_SIZE, initial_shares_held=0, initial_balance=10000,
+                 risk_free_rate=0.0, reward_window=None, random_start=False, cost_model=None, volume=None):
+        if 'close' not in df.columns:
+            raise ValueError("DataFrame must contain a 'close' column.")
+
+        self.df = df.select_dtypes(include=[np.number]).astype(np.float64).reset_index(drop=True)
+        self.window_size = window_size
+        self.initial_balance = initial_balance
+        self.initial_shares_held = initial_shares_held
+        self.risk_free_rate = risk_free_rate
+        self.reward_window = reward_window or window_size
+        self.random_start = random_start
+        self.render_mode = None
+        self.fee_rate, self.half_spread, self.impact = cost_rates(cost_model)
+        self.volume = np.full(len(self.df), np.inf) if volume is None else np.asarray(volume, dtype=np.float64)
+
+        data = self.df.to_numpy()
+        self.prices = np.ascontiguousarray(data[:, self.df.columns.get_loc('close')])
+        self.normalized_windows = normalize_windows(data, self.window_size)
+        self.last_step = len(self.df) - 1
+
+        action_space = spaces.Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+        observation_space = spaces.Box(
+            low=-np.inf, high=np.inf,
+            shape=(self.window_size * self.df.shape[1] + 2,),
+            dtype=np.float32
+        )
+        super(BatchedStockTradingEnv, self).__init__(num_envs, observation_space, action_space)
+
+        self.np_random = np.random.default_rng()
+        self.balance = np.zeros(num_envs)
+        self.shares_held = np.zeros(num_envs)
+        self.current_step = np.zeros(num_envs, dtype=np.int64)
+        self.portfolio_value = np.zeros(num_envs)
+        self.returns_buffer = np.zeros((num_envs, self.reward_window))
+        self.returns_position = np.zeros(num_envs, dtype=np.int64)
+        self.returns_mean = np.zeros(num_envs)
+        self.returns_m2 = np.zeros(num_envs)
+        self.actions = None
+
+    def _reset_envs(self, mask):
+        """Resets the episodes selected by the boolean `mask` in place."""
+        count = int(mask.sum())
+        if self.random_start:
+            self.current_step[mask] = self.np_random.integers(self.window_size, self.last_step, size=count)
+        else:
+            self.current_step[mask] = self.window_size
+
+        self.balance[mask] = self.initial_balance
+        self.shares_held[mask] = self.initial_shares_held
+        self.portfolio_value[mask] = self.initial_balance + self.initial_shares_held * self.prices[self.current_step[mask] - 1]
+
+        self.returns_buffer[mask] = 0.0
+        self.returns_position[mask] = 0
+        self.returns_mean[mask] = 0.0
+        self.returns_m2[mask] = 0.0
+
+    def _observations(self):
+        windows = self.normalized_windows[self.current_step - self.window_size]
+        has_value = self.portfolio_value > 0
+        safe_value = np.where(has_value, self.portfolio_value, 1.0)
+        normalized_balance = np.where(has_value, self.balance / safe_value, 0.0)
+        shares_ratio = np.where(has_value, self.shares_held * self.prices[self.current_step - 1] / safe_value, 0.0)
+
+        obs = np.concatenate([windows, normalized_balance[:, None], shares_ratio[:, None]], axis=1, dtype=np.float32)
+        if not np.isfinite(obs).all():
+            raise ValueError("NaN or Inf in observation vector")
+        return obs
+
+    def reset(self):
+        seed = next((s for s in self._seeds if s is not None), None)
+        if seed is not None:
+            self.np_random = np.random.default_rng(seed)
+        self._reset_seeds()
+        self._reset_options()
+
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        return self._observations()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        trade_amount_percent = np.asarray(self.actions, dtype=np.float64).reshape(self.num_envs, -1)[:, 0]
+        prev_portfolio_value = self.portfolio_value.copy()
+        current_price = self.prices[self.current_step]
+
+        # Execute trades: buy with a fraction of the cash, or sell a fraction of the shares
+        amount_to_spend = np.where(trade_amount_percent > 0, self.balance * trade_amount_percent, 0.0)
+        shares_to_sell = np.where(trade_amount_percent < 0, self.shares_held * np.abs(trade_amount_percent), 0.0)
+        volume = self.volume[self.current_step]
+        buy_price = execution_price(current_price, amount_to_spend / current_price, volume, 1.0, self.half_spread, self.impact) * (1.0 + self.fee_rate)
+        sell_price = execution_price(current_price, shares_to_sell, volume, -1.0, self.half_spread, self.impact) * (1.0 - self.fee_rate)
+        self.balance += shares_to_sell * sell_price - amount_to_spend
+        self.shares_held += amount_to_spend / buy_price - shares_to_sell
+
+        self.current_step += 1
+        dones = self.current_step >= self.last_step
+        next_price = np.where(dones, current_price, self.prices[np.minimum(self.current_step, self.last_step)])
+        self.portfolio_value = self.balance + self.shares_held * next_price
+
+        # --- Hybrid reward (PnL + Sharpe Ratio), see StockTradingEnv.step ---
+        pnl = self.portfolio_value - prev_portfolio_value
+        has_value = prev_portfolio_value > 0
+        portfolio_return = np.where(has_value, self.portfolio_value / np.where(has_value, prev_portfolio_value, 1.0) - 1, 0.0)
+
+        # Vectorized RollingStd.push
+        rows = np.arange(self.num_envs)
+        old_value = self.returns_buffer[rows, self.returns_position]
+        self.returns_buffer[rows, self.returns_position] = portfolio_return
+        self.returns_position = (self.returns_position + 1) % self.reward_window
+        old_mean = self.returns_mean
+        self.returns_mean = old_mean + (portfolio_return - old_value) / self.reward_window
+        self.returns_m2 = np.maximum(
+            self.returns_m2 + (portfolio_return - old_value) * (portfolio_return - self.returns_mean + old_value - old_mean), 0.0
+        )
+        returns_std = np.sqrt(self.returns_m2 / self.reward_window)
+
+        has_std = returns_std > 1e-6
+        sharpe_ratio = np.where(has_std, (portfolio_return - self.risk_free_rate) / np.where(has_std, returns_std, 1.0), 0.0)
+        rewards = pnl + sharpe_ratio * 0.1
+
+        busted = self.portfolio_value < self.initial_balance * 0.5
+        rewards = np.where(busted, rewards - 1000, rewards)
+        dones = dones | busted
+
+        obs = self._observations()
+        infos = [{} for _ in range(self.num_envs)]
+        if dones.any():
+            for i in np.flatnonzero(dones):
+                infos[i]['terminal_observation'] = obs[i].copy()
+                infos[i]['TimeLimit.truncated'] = False
+            self._reset_envs(dones)
+            obs[dones] = self._observations()[dones]
+
+        return obs, rewards.astype(np.float32), dones, infos
+
+    def close(self):
+        pass
+
+    def _indices(self, indices):
+        if indices is None:
+            return range(self.num_envs)
+        if isinstance(indices, int):
+            return [indices]
+        return indices
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        method = getattr(self, method_name)
+        return [method(*method_args, **method_kwargs) for _ in self._indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._indices(indices)]
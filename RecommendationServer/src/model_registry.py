@@ -0,0 +1,54 @@
+import os
+import hashlib
+import threading
+from stable_baselines3 import SAC
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "..", "Model")
+MODEL_SAVE_PATH = os.path.join(MODEL_DIR, "best_model.zip")
+
+# Process-level cache: path -> {'signature', 'sha256', 'model'}
+_policies = {}
+_lock = threading.Lock()
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_policy(path=MODEL_SAVE_PATH):
+    """
+    Returns the SAC policy stored at `path`. The policy is loaded once per
+    process and only reloaded when the file's mtime/size changes AND its
+    content hash differs from the cached one.
+    """
+    signature = _file_signature(path)
+    entry = _policies.get(path)
+    if entry is not None and entry['signature'] == signature:
+        return entry['model']
+
+    with _lock:
+        entry = _policies.get(path)
+        if entry is not None and entry['signature'] == signature:
+            return entry['model']
+
+        sha256 = _file_hash(path)
+        if entry is not None and entry['sha256'] == sha256:
+            # The file was touched or rewritten with identical weights.
+            entry['signature'] = signature
+            return entry['model']
+
+        print(f"MODEL REGISTRY: Loading SAC policy from {path} (sha256 {sha256[:12]})", flush=True)
+        model = SAC.load(path)
+        _policies[path] = {'signature': signature, 'sha256': sha256, 'model': model}
+        return model
+
+def get_policy_version(path=MODEL_SAVE_PATH):
+    """Returns the content hash of the currently cached policy, loading it if needed."""
+    get_policy(path)
+    return _policies[path]['sha256']
@@ -0,0 +1,207 @@
+import numpy as np
+from functools import reduce
+from numba import njit
+from concurrent.futures import ThreadPoolExecutor
+
+from src.feature_cache import get_featured_stock_frame
+from src.calibration import get_strategy_params
+from src.simulation import BIGGEST_THRESHOLD
+from src.costs import resolve_cost_model, cost_rates, execution_price
+from src.metrics import summarize_policy
+from consts import AVAILABLE_STOCKS
+
+# How the shared cash is split between the assets that signal a buy on the same candle:
+# - equal_weight: top every buying asset up to 1/N of the portfolio equity
+# - signal_weighted: top up to a share of equity proportional to how far the signal clears the threshold
+# - cash_split: each buying asset spends its calibrated percentage of an equal slice of the cash
+ALLOCATION_RULES = {'equal_weight': 0, 'signal_weighted': 1, 'cash_split': 2}
+DEFAULT_ALLOCATION_RULE = 'equal_weight'
+
+@njit(cache=True)
+def _portfolio_kernel(close, max_positive_threshold, volume, thresholds, percentages, rule, initial_balance,
+                      fee_rate, half_spread, impact, equity, position_value, traded, costs):
+    n_steps, n_assets = close.shape
+    cash = initial_balance
+    shares_held = np.zeros(n_assets)
+    budgets = np.zeros(n_assets)
+
+    for i in range(n_steps):
+        prices = close[i]
+        signals = max_positive_threshold[i]
+        # As in the single-asset policy, a buy signal only wins over a sell signal while there is cash
+        can_buy = cash > 0
+
+        # Sells first, so the cash they free can fund this candle's buys
+        for s in range(n_assets):
+            is_buy = can_buy and signals[s] >= thresholds[s]
+            if not is_buy and signals[s] <= BIGGEST_THRESHOLD - thresholds[s] and shares_held[s] > 0:
+                shares_to_sell = percentages[s] * shares_held[s]
+                sell_price = execution_price(prices[s], shares_to_sell, volume[i, s], -1.0, half_spread, impact) * (1.0 - fee_rate)
+                cash += shares_to_sell * sell_price
+                shares_held[s] -= shares_to_sell
+                traded[i] += shares_to_sell * prices[s]
+                costs[i] += shares_to_sell * (prices[s] - sell_price)
+
+        if can_buy:
+            portfolio_value = cash + (shares_held * prices).sum()
+            n_buying = 0
+            total_strength = 0.0
+            for s in range(n_assets):
+                if signals[s] >= thresholds[s]:
+                    n_buying += 1
+                    total_strength += signals[s] - thresholds[s] + 1.0
+
+            total_budget = 0.0
+            for s in range(n_assets):
+                budgets[s] = 0.0
+                if not signals[s] >= thresholds[s]:
+                    continue
+                if rule == 0:
+                    budgets[s] = max(portfolio_value / n_assets - shares_held[s] * prices[s], 0.0)
+                elif rule == 1:
+                    weight = (signals[s] - thresholds[s] + 1.0) / total_strength
+                    budgets[s] = max(weight * portfolio_value - shares_held[s] * prices[s], 0.0)
+                else:
+                    budgets[s] = percentages[s] * cash / n_buying
+                total_budget += budgets[s]
+
+            # Targets can ask for more than the cash on hand: scale every buy down alike
+            scale = cash / total_budget if total_budget > cash else 1.0
+            for s in range(n_assets):
+                if budgets[s] <= 0:
+                    continue
+                amount_to_spend = budgets[s] * scale
+                buy_price = execution_price(prices[s], amount_to_spend / prices[s], volume[i, s], 1.0, half_spread, impact) * (1.0 + fee_rate)
+                shares_to_buy = amount_to_spend / buy_price
+                shares_held[s] += shares_to_buy
+                cash -= shares_to_buy * buy_price
+                traded[i] += shares_to_buy * prices[s]
+                costs[i] += shares_to_buy * (buy_price - prices[s])
+
+        position_value[i] = shares_held * prices
+        equity[i] = cash + position_value[i].sum()
+
+def align_stock_frames(frames, columns=('close', 'max_positive_threshold', 'volume')):
+    """
+    Inner-joins per-stock frames on timestamp. Returns the common timestamps
+    and, per column, a (timestamps, stocks) float64 matrix in `frames` order.
+    A missing volume column is treated as unlimited liquidity.
+    """
+    timestamps = reduce(np.intersect1d, [df['timestamp'].to_numpy() for df in frames.values()])
+    matrices = {column: np.empty((len(timestamps), len(frames))) for column in columns}
+    for j, df in enumerate(frames.values()):
+        rows = df.drop_duplicates(subset='timestamp', keep='last').set_index('timestamp').reindex(timestamps)
+        for column in columns:
+            matrices[column][:, j] = rows[column].to_numpy(dtype=np.float64) if column in rows.columns else np.inf
+    return timestamps, matrices
+
+def simulate_portfolio(close, max_positive_threshold, thresholds, percentages, allocation_rule=DEFAULT_ALLOCATION_RULE,
+                       initial_balance=10000, volume=None, cost_model=None):
+    """
+    Runs the XGBoost policy on every asset of the aligned (timestamps, stocks)
+    matrices at once, over one shared cash balance. `thresholds` and
+    `percentages` are the per-asset policy parameters. Returns the portfolio
+    path (equity, traded, costs, total position_value) plus the per-asset
+    position values under `asset_values`.
+    """
+    if allocation_rule not in ALLOCATION_RULES:
+        raise ValueError(f"Unknown allocation rule '{allocation_rule}'. Available: {list(ALLOCATION_RULES)}")
+
+    n_steps, n_assets = close.shape
+    if volume is None:
+        volume = np.full((n_steps, n_assets), np.inf)
+    fee_rate, half_spread, impact = cost_rates(cost_model)
+
+    equity = np.empty(n_steps)
+    asset_values = np.zeros((n_steps, n_assets))
+    traded = np.zeros(n_steps)
+    costs = np.zeros(n_steps)
+    if n_steps > 0:
+        _portfolio_kernel(
+            np.ascontiguousarray(close), np.ascontiguousarray(max_positive_threshold), np.ascontiguousarray(volume),
+            np.asarray(thresholds, dtype=np.float64), np.asarray(percentages, dtype=np.float64),
+            ALLOCATION_RULES[allocation_rule], float(initial_balance), fee_rate, half_spread, impact,
+            equity, asset_values, traded, costs
+        )
+
+    return {
+        'equity': equity,
+        'position_value': asset_values.sum(axis=1),
+        'traded': traded,
+        'costs': costs,
+        'asset_values': asset_values
+    }
+
+def equal_weight_buy_and_hold_path(close, initial_balance=10000, volume=None, cost_model=None):
+    """Benchmark: split the cash equally on the first candle and hold every asset to the end."""
+    n_steps, n_assets = close.shape
+    fee_rate, half_spread, impact = cost_rates(cost_model)
+    if volume is None:
+        volume = np.full((n_steps, n_assets), np.inf)
+
+    budget = initial_balance / n_assets
+    buy_prices = execution_price(close[0], budget / close[0], volume[0], 1.0, half_spread, impact) * (1.0 + fee_rate)
+    shares = budget / buy_prices
+
+    asset_values = close * shares
+    path = {
+        'equity': asset_values.sum(axis=1),
+        'position_value': asset_values.sum(axis=1),
+        'traded': np.zeros(n_steps),
+        'costs': np.zeros(n_steps)
+    }
+    path['traded'][0] = (shares * close[0]).sum()
+    path['costs'][0] = (shares * (buy_prices - close[0])).sum()
+    return path
+
+def run_portfolio_backtest(start_date, end_date, stocks=AVAILABLE_STOCKS, allocation_rule=DEFAULT_ALLOCATION_RULE,
+                           initial_balance=10000, cost_model=None):
+    """
+    Backtests the XGBoost policy on `stocks` as one portfolio: each stock trades
+    with its calibrated parameters, all of them draw on the same cash and the
+    allocation rule arbitrates simultaneous buys.
+    """
+    cost_model = resolve_cost_model(cost_model)
+    if allocation_rule not in ALLOCATION_RULES:
+        raise ValueError(f"Unknown allocation rule '{allocation_rule}'. Available: {list(ALLOCATION_RULES)}")
+
+    with ThreadPoolExecutor(max_workers=len(stocks)) as executor:
+        fetched = dict(zip(stocks, executor.map(lambda stock: get_featured_stock_frame(start_date, end_date, stock), stocks)))
+
+    frames = {stock: df for stock, df in fetched.items() if df is not None and not df.empty}
+    missing = [stock for stock in stocks if stock not in frames]
+    if missing:
+        raise ValueError(f"No data found for {missing} in the selected range.")
+
+    params = {}
+    for stock in stocks:
+        xgb_params = (get_strategy_params(stock) or {}).get('xgboost_policy')
+        if not xgb_params or xgb_params.get('threshold') is None:
+            raise ValueError(f"XGBoost strategy parameters for {stock} are not calibrated yet. A calibration has been queued, try again later.")
+        params[stock] = xgb_params
+
+    timestamps, matrices = align_stock_frames(frames)
+    if len(timestamps) == 0:
+        raise ValueError("The selected stocks share no timestamps in the selected range.")
+
+    path = simulate_portfolio(
+        matrices['close'], matrices['max_positive_threshold'],
+        [params[stock]['threshold'] for stock in stocks], [params[stock]['percentage'] for stock in stocks],
+        allocation_rule, initial_balance, matrices['volume'], cost_model
+    )
+    benchmark = equal_weight_buy_and_hold_path(matrices['close'], initial_balance, matrices['volume'], cost_model)
+
+    final_equity = path['equity'][-1]
+    return {
+        "stocks": list(stocks),
+        "initialBalance": initial_balance,
+        "allocationRule": allocation_rule,
+        "costModel": cost_model,
+        "params": params,
+        "finalWeights": {
+            stock: float(path['asset_values'][-1, j] / final_equity) if final_equity > 0 else 0.0
+            for j, stock in enumerate(stocks)
+        },
+        "portfolio": summarize_policy(path, initial_balance, timestamps),
+        "buyAndHold": summarize_policy(benchmark, initial_balance, timestamps)
+    }
@@ -1,45 +1,142 @@
-import os
-from stable_baselines3 import SAC
+import numpy as np
 
-from src.get_data import get_data_for_recommendation
+from src.indicator_state import get_data_for_recommendation
+from src.get_data import get_latest_timestamp_from_mongo
 from src.environment import define_env
+from src.model_registry import get_policy, get_policy_version
+from src import recommendation_cache
 
-MODEL_DIR = os.path.join(os.path.dirname(__file__), "..", "Model")
-MODEL_SAVE_PATH = os.path.join(MODEL_DIR, "best_model.zip")
-
-def recommend(stock_symbol, initial_balance, initial_shares_held):
+def get_market_observation(stock_symbol):
     """
-    Generates a recommendation for a specific stock symbol.
+    Returns (market_obs, last_price, cache_key) for the newest synced candle of
+    `stock_symbol`. The market part of the observation is the same for every
+    user, so it is built once per (stock, latest timestamp, model version) and
+    served from the recommendation cache afterwards.
     """
+    latest_timestamp = get_latest_timestamp_from_mongo(stock_symbol)
+    if not latest_timestamp:
+        return None
 
-    model = SAC.load(MODEL_SAVE_PATH)
+    cache_key = recommendation_cache.market_key(stock_symbol, latest_timestamp, get_policy_version())
+    cached = recommendation_cache.get_market_observation(cache_key)
+    if cached is not None:
+        return cached[0], cached[1], cache_key
 
     data = get_data_for_recommendation(stock_symbol)
 
     print(f"Fetched data for {stock_symbol}: {data}")
-   
+
     if data is None:
         return None
 
     # Creating an environment
-    recommendation_env = define_env(data, initial_balance, initial_shares_held)
+    recommendation_env = define_env(data)
 
     # mode = 'live' means that the model will make a prediction for the last timestamp in data.
     obs, info = recommendation_env.reset(mode='live')
 
-    # Getting the prediction from the model
-    action, _states = model.predict(obs, deterministic=True)  
+    market_obs = obs[:-2]
+    last_price = float(data['close'].iloc[-1])
+    recommendation_cache.set_market_observation(cache_key, market_obs, last_price)
+
+    return market_obs, last_price, cache_key
+
+def build_observation(market_obs, last_price, initial_balance, initial_shares_held):
+    """Appends the user's balance and holdings ratios exactly as StockTradingEnv does in live mode."""
+    portfolio_value = initial_balance + initial_shares_held * last_price
+    normalized_balance = initial_balance / portfolio_value if portfolio_value > 0 else 0
+    shares_ratio = (initial_shares_held * last_price) / portfolio_value if portfolio_value > 0 else 0
 
-    action = action[0]
+    ratios = np.array([normalized_balance, shares_ratio])
+    if np.isnan(ratios).any() or np.isinf(ratios).any():
+        raise ValueError("NaN or Inf in observation vector")
 
+    return np.append(market_obs, ratios).astype(np.float32)
+
+def to_recommendation(stock_symbol, action):
     direction = -1 if action < 0 else 1 if action > 0 else 0
     pct = abs(action) * 100  # Convert action to percentage
 
-    recommendation = {
+    return {
         "stock_symbol": stock_symbol,
         "direction": direction,
         "pct": float(pct),
         "action": "BUY" if direction == 1 else "SELL" if direction == -1 else "HOLD",
     }
 
-    return recommendation
\ No newline at end of file
+def recommend(stock_symbol, initial_balance, initial_shares_held):
+    """
+    Generates a recommendation for a specific stock symbol.
+    """
+
+    model = get_policy()
+
+    market = get_market_observation(stock_symbol)
+    if market is None:
+        return None
+
+    market_obs, last_price, cache_key = market
+    obs = build_observation(market_obs, last_price, initial_balance, initial_shares_held)
+
+    action = recommendation_cache.get_action(cache_key, obs[-2:])
+    if action is None:
+        # Getting the prediction from the model
+        action, _states = model.predict(obs, deterministic=True)
+        action = action[0]
+        recommendation_cache.set_action(cache_key, obs[-2:], action)
+
+    return to_recommendation(stock_symbol, action)
+
+def recommend_batch(requests):
+    """
+    Generates recommendations for many {'stock_symbol', 'initial_balance',
+    'initial_shares_held'} requests with one policy forward pass over the
+    stacked observations. Actions already in the recommendation cache are
+    served from it; only the rest go through the policy and are cached.
+    Returns, per request, a recommendation dict or the exception that
+    prevented it.
+    """
+    model = get_policy()
+
+    markets = {}
+    results = [None] * len(requests)
+    pending, observations, cache_keys = [], [], []
+
+    for i, req in enumerate(requests):
+        stock_symbol = req['stock_symbol']
+        if stock_symbol not in markets:
+            try:
+                markets[stock_symbol] = get_market_observation(stock_symbol)
+            except Exception as e:
+                markets[stock_symbol] = e
+
+        market = markets[stock_symbol]
+        if isinstance(market, Exception):
+            results[i] = market
+            continue
+        if market is None:
+            results[i] = ValueError("The recommend() function returned None, indicating a data or processing error.")
+            continue
+
+        market_obs, last_price, cache_key = market
+        try:
+            obs = build_observation(market_obs, last_price, req['initial_balance'], req['initial_shares_held'])
+        except Exception as e:
+            results[i] = e
+            continue
+
+        action = recommendation_cache.get_action(cache_key, obs[-2:])
+        if action is not None:
+            results[i] = to_recommendation(stock_symbol, action)
+            continue
+        pending.append(i)
+        observations.append(obs)
+        cache_keys.append(cache_key)
+
+    if observations:
+        actions, _states = model.predict(np.stack(observations), deterministic=True)
+        for i, obs, cache_key, action in zip(pending, observations, cache_keys, actions[:, 0]):
+            recommendation_cache.set_action(cache_key, obs[-2:], action)
+            results[i] = to_recommendation(requests[i]['stock_symbol'], action)
+
+    return results
@@ -0,0 +1,50 @@
+import os
+import json
+import redis
+
+from src.recommendation_cache import get_client
+
+# How long requests are collected before one forward pass answers all of them.
+RECOMMENDATION_BATCH_WINDOW = float(os.environ.get('RECOMMENDATION_BATCH_WINDOW', 0.05)) # seconds
+PENDING_KEY = 'recommendation:pending'
+FLUSH_KEY = 'recommendation:flush_scheduled'
+# The flush guard outlives the window so a lost flush task cannot block batching forever.
+FLUSH_GUARD_TTL_MS = max(1000, int(RECOMMENDATION_BATCH_WINDOW * 10 * 1000))
+
+def enqueue_request(request):
+    """
+    Adds a recommendation request to the pending batch. Returns True when this
+    request opened a new batch window (the caller schedules the flush), False
+    when a flush is already scheduled and None when Redis is unavailable.
+    """
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        pipe = client.pipeline()
+        pipe.rpush(PENDING_KEY, json.dumps(request))
+        pipe.set(FLUSH_KEY, 1, nx=True, px=FLUSH_GUARD_TTL_MS)
+        _, opened = pipe.execute()
+    except redis.RedisError as e:
+        print(f"Warning: Could not queue recommendation request: {e}", flush=True)
+        return None
+    return bool(opened)
+
+def drain_requests():
+    """
+    Atomically takes every pending request and reopens the batch window.
+    Returns [] when Redis is unavailable.
+    """
+    client = get_client()
+    if client is None:
+        return []
+    try:
+        pipe = client.pipeline()
+        pipe.delete(FLUSH_KEY)
+        pipe.lrange(PENDING_KEY, 0, -1)
+        pipe.delete(PENDING_KEY)
+        _, pending, _ = pipe.execute()
+    except redis.RedisError as e:
+        print(f"Warning: Could not drain recommendation requests: {e}", flush=True)
+        return []
+    return [json.loads(item) for item in pending]
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import redis
+
+RECOMMENDATION_CACHE_URL = os.environ.get('RECOMMENDATION_CACHE_URL', os.environ.get('CELERY_BROKER_URL'))
+# A candle is 5 minutes; entries only need to outlive the candle they belong to.
+RECOMMENDATION_CACHE_TTL = int(os.environ.get('RECOMMENDATION_CACHE_TTL', 900))
+
+_client = None
+
+def get_client():
+    global _client
+    if _client is None and RECOMMENDATION_CACHE_URL:
+        _client = redis.Redis.from_url(RECOMMENDATION_CACHE_URL, socket_timeout=0.5)
+    return _client
+
+def market_key(stock, latest_timestamp, model_version):
+    return f"recommendation:{stock}:{latest_timestamp}:{model_version[:16]}"
+
+def _ratios_field(ratios):
+    """Exact float32 bit pattern of (balance ratio, shares ratio), the policy's only per-user inputs."""
+    return "action:" + np.asarray(ratios, dtype=np.float32).tobytes().hex()
+
+def get_market_observation(key):
+    """Returns the cached (market_obs, last_price) for `key`, or None."""
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        obs, price = client.hmget(key, ['obs', 'price'])
+    except redis.RedisError as e:
+        print(f"Warning: Recommendation cache unavailable: {e}", flush=True)
+        return None
+    if obs is None or price is None:
+        return None
+    return np.frombuffer(obs, dtype=np.float32), float(price)
+
+def set_market_observation(key, market_obs, last_price):
+    client = get_client()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline()
+        pipe.hset(key, mapping={'obs': np.asarray(market_obs, dtype=np.float32).tobytes(), 'price': repr(float(last_price))})
+        pipe.expire(key, RECOMMENDATION_CACHE_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Warning: Could not write recommendation cache: {e}", flush=True)
+
+def get_action(key, ratios):
+    """Returns the cached policy action for these ratios on this candle, or None."""
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        action = client.hget(key, _ratios_field(ratios))
+    except redis.RedisError as e:
+        print(f"Warning: Recommendation cache unavailable: {e}", flush=True)
+        return None
+    return None if action is None else np.float32(float(action))
+
+def set_action(key, ratios, action):
+    client = get_client()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline()
+        pipe.hset(key, _ratios_field(ratios), repr(float(action)))
+        pipe.expire(key, RECOMMENDATION_CACHE_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Warning: Could not write recommendation cache: {e}", flush=True)
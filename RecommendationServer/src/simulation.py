@@ -0,0 +1,205 @@
+import numpy as np
+from numba import njit
+
+from src.costs import cost_rates, execution_price
+
+# The binary model publishes predictions for thresholds 0..8.
+BIGGEST_THRESHOLD = 8
+
+def as_float_array(df, column):
+    """Returns a DataFrame column as a contiguous float64 array for the kernels."""
+    return np.ascontiguousarray(df[column].to_numpy(dtype=np.float64))
+
+def volume_array(df, length=None):
+    """
+    Candle volume for the slippage model. Without a `volume` column every
+    order is treated as a negligible part of the candle (no slippage).
+    """
+    if df is not None and 'volume' in df.columns:
+        return as_float_array(df, 'volume')
+    return np.full(len(df) if length is None else length, np.inf)
+
+@njit(cache=True)
+def _xgboost_policy_kernel(close, max_positive_threshold, volume, initial_balance, threshold, percentage_to_act,
+                           fee_rate, half_spread, impact, equity, position_value, traded, costs):
+    balance = initial_balance
+    shares_held = 0.0
+    sell_threshold = BIGGEST_THRESHOLD - threshold
+
+    for i in range(close.shape[0]):
+        current_price = close[i]
+        prediction = max_positive_threshold[i]
+
+        if prediction >= threshold and balance > 0:
+            # Buy Signal
+            amount_to_spend = percentage_to_act * balance
+            buy_price = execution_price(current_price, amount_to_spend / current_price, volume[i], 1.0, half_spread, impact) * (1.0 + fee_rate)
+            shares_to_buy = amount_to_spend / buy_price
+            shares_held += shares_to_buy
+            balance -= shares_to_buy * buy_price
+            traded[i] = shares_to_buy * current_price
+            costs[i] = shares_to_buy * (buy_price - current_price)
+        elif prediction <= sell_threshold and shares_held > 0:
+            # Sell Signal
+            shares_to_sell = percentage_to_act * shares_held
+            sell_price = execution_price(current_price, shares_to_sell, volume[i], -1.0, half_spread, impact) * (1.0 - fee_rate)
+            balance += shares_to_sell * sell_price
+            shares_held -= shares_to_sell
+            traded[i] = shares_to_sell * current_price
+            costs[i] = shares_to_sell * (current_price - sell_price)
+        # Else: Hold
+
+        position_value[i] = shares_held * current_price
+        equity[i] = balance + position_value[i]
+
+    return balance + shares_held * close[close.shape[0] - 1]
+
+@njit(cache=True)
+def _lstm_policy_kernel(close, pct_prediction, volume, initial_balance, threshold,
+                        fee_rate, half_spread, impact, equity, position_value, traded, costs):
+    balance = initial_balance
+    shares_held = 0.0
+
+    for i in range(close.shape[0]):
+        current_price = close[i]
+        prediction = pct_prediction[i]
+
+        if prediction > threshold and balance > 0:
+            # Buy Signal
+            buy_price = execution_price(current_price, balance / current_price, volume[i], 1.0, half_spread, impact) * (1.0 + fee_rate)
+            shares_to_buy = balance / buy_price
+            traded[i] = shares_to_buy * current_price
+            costs[i] = shares_to_buy * (buy_price - current_price)
+            shares_held += shares_to_buy
+            balance = 0.0
+        elif prediction < -threshold and shares_held > 0:
+            # Sell Signal
+            sell_price = execution_price(current_price, shares_held, volume[i], -1.0, half_spread, impact) * (1.0 - fee_rate)
+            traded[i] = shares_held * current_price
+            costs[i] = shares_held * (current_price - sell_price)
+            balance += shares_held * sell_price
+            shares_held = 0.0
+        # Else: Hold
+
+        position_value[i] = shares_held * current_price
+        equity[i] = balance + position_value[i]
+
+    return balance + shares_held * close[close.shape[0] - 1]
+
+# Releases the GIL so parameter sweeps can run on threads sharing one frame
+@njit(cache=True, nogil=True)
+def _xgboost_grid_kernel(close, max_positive_threshold, volume, initial_balance, thresholds, percentages, fee_rate, half_spread, impact):
+    n_thresholds = thresholds.shape[0]
+    n_percentages = percentages.shape[0]
+    balance = np.full((n_thresholds, n_percentages), initial_balance)
+    shares_held = np.zeros((n_thresholds, n_percentages))
+
+    for i in range(close.shape[0]):
+        current_price = close[i]
+        prediction = max_positive_threshold[i]
+
+        for t in range(n_thresholds):
+            threshold = thresholds[t]
+            is_buy = prediction >= threshold
+            is_sell = prediction <= BIGGEST_THRESHOLD - threshold
+            if not is_buy and not is_sell:
+                continue
+
+            for p in range(n_percentages):
+                percentage_to_act = percentages[p]
+                if is_buy and balance[t, p] > 0:
+                    amount_to_spend = percentage_to_act * balance[t, p]
+                    buy_price = execution_price(current_price, amount_to_spend / current_price, volume[i], 1.0, half_spread, impact) * (1.0 + fee_rate)
+                    shares_to_buy = amount_to_spend / buy_price
+                    shares_held[t, p] += shares_to_buy
+                    balance[t, p] -= shares_to_buy * buy_price
+                elif is_sell and shares_held[t, p] > 0:
+                    shares_to_sell = percentage_to_act * shares_held[t, p]
+                    sell_price = execution_price(current_price, shares_to_sell, volume[i], -1.0, half_spread, impact) * (1.0 - fee_rate)
+                    balance[t, p] += shares_to_sell * sell_price
+                    shares_held[t, p] -= shares_to_sell
+
+    return balance + shares_held * close[close.shape[0] - 1]
+
+def empty_path(length):
+    """Per-candle outputs of a simulation: equity, value of the held position, notional traded and trading costs paid."""
+    return {
+        'equity': np.empty(length),
+        'position_value': np.empty(length),
+        'traded': np.zeros(length),
+        'costs': np.zeros(length)
+    }
+
+def simulate_xgboost_policy_path(close, max_positive_threshold, initial_balance=10000, threshold=5, percentage_to_act=0.1,
+                                 volume=None, cost_model=None):
+    """
+    Array version of the XGBoost policy. `close`, `max_positive_threshold` and
+    the optional `volume` are aligned float64 arrays; the buy/sell/hold state
+    machine runs in a single compiled pass and fills the per-candle equity,
+    position value, traded notional and cost arrays. Orders are filled at the
+    prices of `cost_model` (see src.costs, frictionless by default).
+    """
+    path = empty_path(len(close))
+    if len(close) > 0:
+        if volume is None:
+            volume = np.full(len(close), np.inf)
+        fee_rate, half_spread, impact = cost_rates(cost_model)
+        _xgboost_policy_kernel(
+            close, max_positive_threshold, volume, float(initial_balance), float(threshold), float(percentage_to_act),
+            fee_rate, half_spread, impact,
+            path['equity'], path['position_value'], path['traded'], path['costs']
+        )
+    return path
+
+def simulate_xgboost_policy(close, max_positive_threshold, initial_balance=10000, threshold=5, percentage_to_act=0.1,
+                            volume=None, cost_model=None):
+    """Final portfolio value of the XGBoost policy."""
+    if len(close) == 0:
+        return initial_balance
+
+    path = simulate_xgboost_policy_path(close, max_positive_threshold, initial_balance, threshold, percentage_to_act, volume, cost_model)
+    return float(path['equity'][-1])
+
+def simulate_lstm_policy_path(close, pct_prediction, initial_balance=10000, threshold=0.002, volume=None, cost_model=None):
+    """
+    Array version of the LSTM policy: all-in when the predicted move is above
+    `threshold`, all-out when it is below `-threshold`.
+    """
+    path = empty_path(len(close))
+    if len(close) > 0:
+        if volume is None:
+            volume = np.full(len(close), np.inf)
+        fee_rate, half_spread, impact = cost_rates(cost_model)
+        _lstm_policy_kernel(
+            close, pct_prediction, volume, float(initial_balance), float(threshold),
+            fee_rate, half_spread, impact,
+            path['equity'], path['position_value'], path['traded'], path['costs']
+        )
+    return path
+
+def simulate_lstm_policy(close, pct_prediction, initial_balance=10000, threshold=0.002, volume=None, cost_model=None):
+    """Final portfolio value of the LSTM policy."""
+    if len(close) == 0:
+        return initial_balance
+
+    path = simulate_lstm_policy_path(close, pct_prediction, initial_balance, threshold, volume, cost_model)
+    return float(path['equity'][-1])
+
+def sweep_xgboost_policy(close, max_positive_threshold, thresholds, percentages, initial_balance=10000,
+                         volume=None, cost_model=None):
+    """
+    Simulates the XGBoost policy for every threshold x percentage combination
+    in one pass over the candles. Returns a (len(thresholds), len(percentages))
+    array of final portfolio values.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    percentages = np.asarray(percentages, dtype=np.float64)
+
+    if len(close) == 0:
+        return np.full((len(thresholds), len(percentages)), float(initial_balance))
+
+    if volume is None:
+        volume = np.full(len(close), np.inf)
+    fee_rate, half_spread, impact = cost_rates(cost_model)
+    return _xgboost_grid_kernel(close, max_positive_threshold, volume, float(initial_balance), thresholds, percentages,
+                                fee_rate, half_spread, impact)
@@ -0,0 +1,109 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from src.feature_cache import get_featured_stock_frame
+from src.backtest_engine import sweep_strategy_params, xgboost_policy_path
+from src.simulation import empty_path
+from src.metrics import summarize_policy
+from src.costs import resolve_cost_model
+
+# Rolling windows: re-fit on the last WALK_FORWARD_TRAIN_DAYS, trade the next WALK_FORWARD_TEST_DAYS.
+WALK_FORWARD_TRAIN_DAYS = int(os.environ.get('WALK_FORWARD_TRAIN_DAYS', 30))
+WALK_FORWARD_TEST_DAYS = int(os.environ.get('WALK_FORWARD_TEST_DAYS', 7))
+
+def _optimize_fold(df, train_start, train_end, initial_balance, cost_model):
+    """(Thread pool worker) Sweeps the XGBoost policy grid on one training window of the shared frame."""
+    sweep = sweep_strategy_params(df.iloc[train_start:train_end], initial_balance, cost_model=cost_model)
+    return sweep['best_params'], sweep['best_value']
+
+def walk_forward_folds(timestamps, train_days=WALK_FORWARD_TRAIN_DAYS, test_days=WALK_FORWARD_TEST_DAYS):
+    """
+    Row bounds (train_start, train_end, test_end) of the rolling folds over
+    sorted `timestamps`. Training windows span `train_days` and the test
+    windows that follow them tile the rest of the range without overlap.
+    """
+    times = pd.to_datetime(pd.Series(timestamps)).to_numpy()
+    if len(times) == 0:
+        return []
+
+    train_span, test_span = np.timedelta64(train_days, 'D'), np.timedelta64(test_days, 'D')
+    folds = []
+    test_start_time = times[0] + train_span
+    while test_start_time <= times[-1]:
+        train_start, train_end, test_end = np.searchsorted(
+            times, [test_start_time - train_span, test_start_time, test_start_time + test_span]
+        )
+        if test_end > train_end:
+            folds.append((int(train_start), int(train_end), int(test_end)))
+        test_start_time += test_span
+    return folds
+
+def run_walk_forward(stock, start_date, end_date, train_days=WALK_FORWARD_TRAIN_DAYS, test_days=WALK_FORWARD_TEST_DAYS,
+                     initial_balance=10000, cost_model=None, max_workers=None):
+    """
+    Walk-forward optimization of the XGBoost policy for one stock. The range is
+    fetched once; every fold's parameter sweep runs in parallel on the shared
+    frame, then each out-of-sample window is traded with the parameters of its
+    own training window. The test windows are chained into one out-of-sample
+    equity curve: each starts flat with the equity the previous one ended with.
+
+    The sweeps run on threads: the grid kernel releases the GIL, so they use
+    every core without copying the frame, and the pool also starts inside
+    daemonic Celery prefork workers.
+    """
+    cost_model = resolve_cost_model(cost_model)
+    df = get_featured_stock_frame(start_date, end_date, stock)
+    if df is None or df.empty:
+        raise ValueError(f"No data found for {stock} in the selected range.")
+
+    folds = walk_forward_folds(df['timestamp'], train_days, test_days)
+    if not folds:
+        raise ValueError(f"The selected range is shorter than the {train_days}-day training window.")
+
+    max_workers = max_workers or min(len(folds), os.cpu_count() or 1)
+    print(f">>> Walk-forward for {stock}: {len(folds)} folds on {max_workers} workers. <<<", flush=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_optimize_fold, df, train_start, train_end, initial_balance, cost_model)
+                   for train_start, train_end, _ in folds]
+        fits = [future.result() for future in futures]
+
+    timestamps = df['timestamp'].to_numpy()
+    paths, fold_results = [], []
+    balance = float(initial_balance)
+    for (train_start, train_end, test_end), (best_params, best_value) in zip(folds, fits):
+        test_df = df.iloc[train_end:test_end]
+        if best_params['threshold'] is None:
+            # No profitable combination in training: stay in cash for this window
+            path = empty_path(len(test_df))
+            path['equity'][:] = balance
+            path['position_value'][:] = 0.0
+        else:
+            path = xgboost_policy_path(test_df, balance, best_params['threshold'], best_params['percentage'], cost_model)
+
+        fold_results.append({
+            "trainStart": str(timestamps[train_start]),
+            "trainEnd": str(timestamps[train_end - 1]),
+            "testStart": str(timestamps[train_end]),
+            "testEnd": str(timestamps[test_end - 1]),
+            "params": best_params,
+            "trainValue": best_value,
+            "testReturn": float(path['equity'][-1] / balance - 1) if balance > 0 else 0.0
+        })
+        paths.append(path)
+        balance = float(path['equity'][-1])
+
+    out_of_sample = {key: np.concatenate([path[key] for path in paths]) for key in paths[0]}
+    out_of_sample_start, out_of_sample_end = folds[0][1], folds[-1][2]
+
+    return {
+        "stock": stock,
+        "initialBalance": initial_balance,
+        "trainDays": train_days,
+        "testDays": test_days,
+        "costModel": cost_model,
+        "folds": fold_results,
+        "outOfSample": summarize_policy(out_of_sample, initial_balance, timestamps[out_of_sample_start:out_of_sample_end])
+    }
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from src import backtest_engine
+from consts import final_feature_columns
+
+class AllInPolicy:
+    """Buys with all the cash on every step."""
+    def predict(self, obs, deterministic=True):
+        return np.array([1.0], dtype=np.float32), None
+
+def crashing_frame(num_rows=100):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(num_rows, len(final_feature_columns))), columns=final_feature_columns)
+    df['close'] = np.linspace(100.0, 10.0, num_rows)
+    return df
+
+def test_rl_policy_path_keeps_final_value_after_bust(monkeypatch):
+    monkeypatch.setattr(backtest_engine, 'get_policy', lambda: AllInPolicy())
+    df = crashing_frame()
+
+    env = backtest_engine.define_env(df, 10000)
+    obs, info = env.reset()
+    done = False
+    while not done:
+        obs, reward, terminated, truncated, info = env.step(AllInPolicy().predict(obs)[0])
+        done = terminated or truncated
+    assert env.current_step < len(df) - 1 # The env busted before the last row
+
+    path = backtest_engine.rl_policy_path(df, 10000)
+    assert np.all(path['equity'][env.current_step:] == env.portfolio_value)
+    assert np.all(path['position_value'][env.current_step:] == env.portfolio_value - env.balance)
+    assert backtest_engine.run_rl_policy(df, 10000) == env.portfolio_value
+    assert env.portfolio_value < 5000
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from src import feature_cache
+
+class FakeMongo:
+    """Candles every 5 minutes over three days; binary predictions can be backfilled per day."""
+    def __init__(self):
+        self.timestamps = pd.date_range('2025-01-01', '2025-01-03 23:55:00', freq='5min').strftime('%Y-%m-%d %H:%M:%S')
+        self.predicted_days = {'2025-01-01', '2025-01-03'}
+        self.computed = []
+
+    def fetch_and_prepare_single_stock(self, start_date, end_date, stock="BTC"):
+        self.computed.append((start_date, end_date))
+        timestamps = self.timestamps[(self.timestamps >= start_date) & (self.timestamps <= end_date)]
+        predicted = np.array([timestamp[:10] in self.predicted_days for timestamp in timestamps])
+        return pd.DataFrame({
+            'timestamp': timestamps,
+            'close': 100.0,
+            'max_positive_threshold': np.where(predicted, 5.0, -1.0)
+        })
+
+    def get_latest_timestamp_from_mongo(self, stock):
+        return self.timestamps[-1]
+
+    def count_predictions_by_day(self, start_date, end_date, stock):
+        return {day: [288, 0] for day in self.predicted_days if start_date[:10] <= day <= end_date[:10]}
+
+def fake_mongo(monkeypatch):
+    mongo = FakeMongo()
+    for name in ('fetch_and_prepare_single_stock', 'get_latest_timestamp_from_mongo', 'count_predictions_by_day'):
+        monkeypatch.setattr(feature_cache, name, getattr(mongo, name))
+    return mongo
+
+def test_refresh_refeatures_days_whose_predictions_were_backfilled(monkeypatch, tmp_path):
+    mongo = fake_mongo(monkeypatch)
+    start, end = '2025-01-01 00:00:00', '2025-01-03 23:55:00'
+
+    df = feature_cache.get_featured_stock_frame(start, end, 'BTC', tmp_path)
+    assert (df.loc[df['timestamp'].str.startswith('2025-01-02'), 'max_positive_threshold'] == -1.0).all()
+
+    # Nothing changed: served from the cache
+    mongo.computed.clear()
+    feature_cache.get_featured_stock_frame(start, end, 'BTC', tmp_path)
+    assert mongo.computed == []
+
+    # The missing-preds script backfills the second day: only that day is featured again
+    mongo.predicted_days.add('2025-01-02')
+    df = feature_cache.get_featured_stock_frame(start, end, 'BTC', tmp_path)
+    assert mongo.computed == [(feature_cache._shift('2025-01-02 00:00:00', -feature_cache.FEATURE_WARMUP_ROWS * feature_cache.CANDLE_INTERVAL), '2025-01-02 23:59:59')]
+    assert (df['max_positive_threshold'] == 5.0).all()
+    assert len(df) == len(mongo.timestamps)
+
+    mongo.computed.clear()
+    feature_cache.get_featured_stock_frame(start, end, 'BTC', tmp_path)
+    assert mongo.computed == []
@@ -9,3 +9,7 @@ for f in /dumps/crypto_predictions/*.bson; do
   mongorestore --db crypto_predictions --collection "$coll" "$f"
 done
 echo ">>> Restore complete."
+
+echo ">>> Creating timestamp indexes…"
+mongosh --quiet crypto_predictions /scripts/ensure-indexes.js
+echo ">>> Indexes ready."
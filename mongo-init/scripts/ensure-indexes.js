@@ -0,0 +1,11 @@
+// project-root/mongo-init/scripts/ensure-indexes.js
+// The recommendation service matches and joins the candle and prediction
+// collections on timestamp. createIndex is a no-op for an index that already
+// exists, so this runs on every start: from init-mongo.sh on a fresh volume
+// and from the one-shot `mongo-indexes` compose service on existing ones.
+db.getCollectionNames()
+  .filter(name => /^(ohlc|binary|pct)_/.test(name))
+  .forEach(name => {
+    print(`  → ${name}.timestamp`);
+    db.getCollection(name).createIndex({ timestamp: 1 });
+  });